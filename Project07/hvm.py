@@ -5,37 +5,120 @@ hvm.py -- VM Translator, Part II
 
 import sys
 import os
+import io
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
 from hvmCommands import *
 from hvmParser import *
 from hvmCodeWriter import *
 
-def Process(sourceFile, codeWriter):
-    global sysinit, debug
+def Process(sourceFile, codeWriter, debug=False):
+    """
+    Translate 'sourceFile' to 'codeWriter'.
+    Returns False, after printing the error, if the file could not be
+    read or has a bad command.
+    """
     print('Processing ' + sourceFile)
+    codeWriter.SetFileName(sourceFile)
     if debug:
+        # The parser writes the source comments to the output.
         parser = Parser(sourceFile, codeWriter)
-    else:
-        parser = Parser(sourceFile)
-    codeWriter.SetFileName(sourceFile)
-    
-    while parser.Advance():
-        commandType = parser.CommandType()
-        if commandType == C_ARITHMETIC:
-            codeWriter.WriteArithmetic(parser.Arg1())
-        elif commandType in (C_PUSH, C_POP):
-            codeWriter.WritePushPop(commandType, parser.Arg1(), parser.Arg2())
-        elif commandType == C_LABEL:
-            codeWriter.WriteLabel(parser.Arg1())
-        elif commandType == C_GOTO:
-            codeWriter.WriteGoto(parser.Arg1())
-        elif commandType == C_IF:
-            codeWriter.WriteIf(parser.Arg1())
-        elif commandType == C_FUNCTION:
-            codeWriter.WriteFunction(parser.Arg1(), parser.Arg2())
-        elif commandType == C_RETURN:
-            codeWriter.WriteReturn()
-        elif commandType == C_CALL:
-            codeWriter.WriteCall(parser.Arg1(), parser.Arg2())
+        while parser.Advance():
+            Write(codeWriter, parser.CommandType(), parser.Arg1(),
+                  parser.Arg2())
+        return True
+    try:
+        commands = ReadCommands(sourceFile)
+    except OSError:
+        print('Could not open source file "' + sourceFile + '"')
+        return False
+    except ValueError as e:
+        print(str(e))
+        return False
+    i = 0
+    while i < len(commands):
+        count = codeWriter.WriteFused(commands, i)
+        if count == 0:
+            command = commands[i]
+            Write(codeWriter, command.commandType, command.arg1, command.arg2)
+            count = 1
+        i += count
+    return True
+
+
+def TranslateFile(job):
+    """
+    Worker process entry: translate one source file in file label
+    mode.
+    'job' is (sourceFile, options, debug) where 'options' is a list of
+    (CodeWriter mode method name, value).
+
+    Returns (code, cmpLabels, callRoutines, functionNames, messages)
+    where 'messages' is the text the translator printed.  'code' is
+    None if the file could not be translated.
+    """
+    (sourceFile, options, debug) = job
+    outputFile = io.StringIO()
+    messages = io.StringIO()
+    with contextlib.redirect_stdout(messages):
+        codeWriter = CodeWriter(sourceFile, outputFile)
+        SetOptions(codeWriter, options)
+        codeWriter.FileLabels(True)
+        if not Process(sourceFile, codeWriter, debug):
+            return (None, None, None, None, messages.getvalue())
+        codeWriter.EndFile()
+    return (outputFile.getvalue(), codeWriter.cmpLabels,
+            codeWriter.callRoutines, codeWriter.functionNames,
+            messages.getvalue())
+
+
+def ProcessParallel(sourceFiles, codeWriter, options, debug=False,
+                    jobs=None):
+    """
+    Translate 'sourceFiles' in at most 'jobs' worker processes with
+    'options', see TranslateFile(), and write their code to
+    'codeWriter' in the order of 'sourceFiles'.  Functions defined in
+    more than one file are reported here, as the workers only see
+    their own file.
+    """
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        results = executor.map(TranslateFile, [(sourceFile, options, debug)
+                                               for sourceFile in sourceFiles])
+        for (code, cmpLabels, callRoutines, functionNames, messages) in \
+                results:
+            sys.stdout.write(messages)
+            if code == None:
+                sys.exit(-1)
+            codeWriter.WriteTranslated(code, cmpLabels, callRoutines,
+                                       functionNames)
+
+
+def SetOptions(codeWriter, options):
+    """
+    Set the modes of 'codeWriter' from 'options', a list of
+    (CodeWriter mode method name, value).
+    """
+    for (method, value) in options:
+        getattr(codeWriter, method)(value)
+
+
+def Write(codeWriter, commandType, arg1, arg2):
+    if commandType == C_ARITHMETIC:
+        codeWriter.WriteArithmetic(arg1)
+    elif commandType in (C_PUSH, C_POP):
+        codeWriter.WritePushPop(commandType, arg1, arg2)
+    elif commandType == C_LABEL:
+        codeWriter.WriteLabel(arg1)
+    elif commandType == C_GOTO:
+        codeWriter.WriteGoto(arg1)
+    elif commandType == C_IF:
+        codeWriter.WriteIf(arg1)
+    elif commandType == C_FUNCTION:
+        codeWriter.WriteFunction(arg1, arg2)
+    elif commandType == C_RETURN:
+        codeWriter.WriteReturn()
+    elif commandType == C_CALL:
+        codeWriter.WriteCall(arg1, arg2)
 
 
 def Usage():
@@ -45,15 +128,76 @@ def Usage():
     print()
     print('    -d option writes VM commands as comments in .asm file.')
     print('    -nosysinit option does not write Sys.init call in the bootstrap.')
+    print('    -sharedcompare option calls shared routines for eq, gt and lt.')
+    print('    -sharedcall option calls shared routines for call and return.')
+    print('    -cachetop option keeps the top of the VM stack in D.')
+    print('    -specialize option writes push and pop code specialized for')
+    print('    each segment and index.')
+    print('    -compactlocals option clears function locals without pushing')
+    print('    each one.')
+    print('    -O level option sets the optimization level: 0 (default) none,')
+    print('    1 -cachetop and -compactlocals, 2 as 1 and fused command')
+    print('    sequences.  Fusing is off with -d.')
+    print('    -j n option translates the files in n worker processes, with')
+    print('    labels numbered in each file, and merges them in file name')
+    print('    order.')
+    print('    -assemble option hands the code to the Hack assembler in')
+    print('    Project_05 and writes sourceFile.hack instead of sourceFile.asm.')
     sys.exit(-1)
     
 
 def main():
-    global sysinit, debug
     sysinit = True
     debug = False
+    sharedCompare = False
+    sharedCall = False
+    cacheTop = False
+    specialize = False
+    compactLocals = False
+    level = 0
+    assemble = False
+    jobs = None
     while True:
+        if len(sys.argv) >= 3 and sys.argv[1] == '-O':
+            if sys.argv[2] not in ('0', '1', '2'):
+                Usage()
+            level = int(sys.argv[2])
+            del (sys.argv[1:3])
+            continue
+        if len(sys.argv) >= 3 and sys.argv[1] == '-j':
+            try:
+                jobs = int(sys.argv[2])
+            except ValueError:
+                Usage()
+            if jobs < 1:
+                Usage()
+            del (sys.argv[1:3])
+            continue
         if len(sys.argv) >= 2:
+            if sys.argv[1] == '-assemble':
+                assemble = True
+                del (sys.argv[1])
+                continue
+            if sys.argv[1] == '-compactlocals':
+                compactLocals = True
+                del (sys.argv[1])
+                continue
+            if sys.argv[1] == '-specialize':
+                specialize = True
+                del (sys.argv[1])
+                continue
+            if sys.argv[1] == '-cachetop':
+                cacheTop = True
+                del (sys.argv[1])
+                continue
+            if sys.argv[1] == '-sharedcall':
+                sharedCall = True
+                del (sys.argv[1])
+                continue
+            if sys.argv[1] == '-sharedcompare':
+                sharedCompare = True
+                del (sys.argv[1])
+                continue
             if sys.argv[1] == '-nosysinit':
                 sysinit = False
                 del (sys.argv[1])
@@ -76,23 +220,60 @@ def main():
     outName = os.path.splitext(outName)[0] + os.path.extsep + 'asm'
     if len(dirName) > 0:
         outName = dirName + os.path.sep + outName
-    codeWriter = CodeWriter(outName)
-    codeWriter.Debug(debug)
+    if assemble:
+        # The code goes to the assembler in memory; no .asm is written.
+        outputFile = io.StringIO()
+        codeWriter = CodeWriter(outName, outputFile)
+    else:
+        codeWriter = CodeWriter(outName)
+    options = [('Debug', debug),
+               ('SharedCompare', sharedCompare),
+               ('SharedCall', sharedCall),
+               ('CacheTop', cacheTop or level >= 1),
+               ('Fuse', level >= 2),
+               ('Specialize', specialize),
+               ('CompactLocals', compactLocals or level >= 1)]
+    SetOptions(codeWriter, options)
     codeWriter.WriteInit(sysinit)
     
     if os.path.isdir(sourceName):
-        # process all .vm files in dir
+        # process all .vm files in dir, in name order
         dirName = sourceName
         print('Processing directory ' + dirName)
-        for sourceName in os.listdir(dirName):
-            if os.path.splitext(sourceName)[1].lower() == os.path.extsep + 'vm':
-                Process(dirName + os.path.sep + sourceName, codeWriter)
+        sourceFiles = [dirName + os.path.sep + fileName
+                       for fileName in sorted(os.listdir(dirName))
+                       if os.path.splitext(fileName)[1].lower() ==
+                       os.path.extsep + 'vm']
     else:
         # process single .vm file
-        Process(sourceName, codeWriter)
+        sourceFiles = [sourceName]
+    if jobs != None:
+        ProcessParallel(sourceFiles, codeWriter, options, debug, jobs)
+    else:
+        for sourceFile in sourceFiles:
+            if not Process(sourceFile, codeWriter, debug):
+                sys.exit(-1)
 
     codeWriter.Close()
+    if assemble:
+        Assemble(outputFile.getvalue(),
+                 os.path.splitext(outName)[0] + os.path.extsep + 'hack')
+
+
+def Assemble(code, hackName):
+    """
+    Assemble the Hack assembly text 'code' with the Project_05
+    assembler and write the .hack file 'hackName'.
+    """
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 os.pardir, 'Project_05'))
+    import hasm
+    print('Assembling ' + hackName)
+    words = [hasm.Int2Bin(word) for word in hasm.Assembler().Words(code)]
+    with open(hackName, 'w') as file:
+        file.write('\n'.join(words) + '\n')
 
 
 
-main()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,661 @@
+#!/usr/bin/python3
+"""
+hvmBench.py -- Benchmarks for the Hack VM emulator
+
+usage: hvmBench [-n count] [benchmark ...]
+
+Runs VM programs that call the OS in a loop 'count' times (default
+1000), with the OS as .vm code and with its functions as Python
+builtins, and reports the time and VM commands of each.  The parse
+benchmark times reading the OS .vm files, and the size benchmark
+reports the ROM words of the OS and test programs translated by hvm.py
+with its code generation options; the functions benchmark reports them
+per OS function.  The cycles benchmark reports the instructions
+executed running programs on the CPU emulator, and the locals
+benchmark the same for calls of functions with more and more locals.
+The translate benchmark times translating the OS and a large program
+to .asm and to .hack, and the parallel benchmark with worker
+processes.  With no benchmark names all benchmarks are run.
+"""
+
+import sys
+import os
+import io
+import time
+import contextlib
+import shutil
+import tempfile
+import subprocess
+import hvmBuiltins
+import hvmParser
+import hvm
+from hvmEmulator import *
+
+
+_osDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir,
+                      'nand2tetris', 'tools', 'OS')
+_projects = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         os.pardir, 'nand2tetris', 'projects')
+
+# hvm.py code generation options compared by the size, functions and
+# cycles benchmarks, by column name.
+_codeOptions = [
+    ('compare', '-sharedcompare'),
+    ('call', '-sharedcall'),
+    ('cachetop', '-cachetop'),
+    ('specialize', '-specialize'),
+    ('locals', '-compactlocals'),
+    ('fused', '-O 2'),
+    ('all', '-sharedcompare -sharedcall -O 2'),
+    ]
+
+# Functions listed by the functions benchmark, largest first.
+_functionCount = 20
+
+# Times the OS is read by the parse benchmark.
+_parseRounds = 20
+
+# Local counts of the functions called by the locals benchmark.
+_localCounts = (1, 2, 3, 4, 8, 9, 16)
+
+# Main.f returns 1 plus the sum of its locals, and then sets them all to
+# 7, so that locals that are not cleared on the next call show up.
+_localsBody = 'call Main.f 0'
+_localsFunction = '''\
+function Main.f %d
+push constant 1
+%s
+%s
+return
+'''
+
+# Worker counts compared by the parallel benchmark.
+_jobCounts = (1, 2, 4)
+
+# Times each translation is timed by the translate benchmark; the best
+# is reported.
+_translateRounds = 3
+
+
+# Sys.init stores Main.main's value in temp 1 and sets temp 2 to 1, or
+# Sys.error stores the error code and sets it to 2.
+_sysSource = '''\
+function Sys.init 0
+call Memory.init 0
+pop temp 0
+call Math.init 0
+pop temp 0
+call Main.main 0
+pop temp 1
+push constant 1
+pop temp 2
+label HALT
+goto HALT
+function Sys.error 0
+push argument 0
+pop temp 1
+push constant 2
+pop temp 2
+label HALT
+goto HALT
+'''
+
+# Main.main loops 'count' times over the body, which may use local 2
+# and adds its value to the sum in local 0.
+_mainSource = '''\
+function Main.main 3
+push constant 0
+pop local 0
+push constant %d
+pop local 1
+label LOOP
+push local 1
+push constant 0
+eq
+if-goto END
+%s
+push local 0
+add
+pop local 0
+push local 1
+push constant 1
+sub
+pop local 1
+goto LOOP
+label END
+push local 0
+return
+'''
+
+# sum += i * 37 + i / 7 + max(i, 100) - sqrt(i)
+_arithmeticBody = '''\
+push local 1
+push constant 37
+call Math.multiply 2
+push local 1
+push constant 7
+call Math.divide 2
+add
+push local 1
+push constant 100
+call Math.max 2
+add
+push local 1
+call Math.sqrt 1
+sub'''
+
+# s = String.new(6); s.setInt(i); s.appendChar('7');
+# sum += s.intValue(); s.dispose()
+_stringBody = '''\
+push constant 6
+call String.new 1
+pop local 2
+push local 2
+push local 1
+call String.setInt 2
+pop temp 0
+push local 2
+push constant 55
+call String.appendChar 2
+pop temp 0
+push local 2
+call String.intValue 1
+push local 2
+call String.dispose 1
+pop temp 0'''
+
+
+def Generate(dirName, count, body):
+    """
+    Write Sys.vm and Main.vm for a program that runs 'body' 'count'
+    times to 'dirName'.
+    """
+    with open(os.path.join(dirName, 'Sys.vm'), 'w') as file:
+        file.write(_sysSource)
+    with open(os.path.join(dirName, 'Main.vm'), 'w') as file:
+        file.write(_mainSource % (count, body))
+
+
+def RunProgram(dirName, builtins):
+    """
+    Run the program in 'dirName' until Sys.init or Sys.error sets
+    temp 2.  Returns the emulator.
+    """
+    emulator = Emulator(builtins=builtins)
+    emulator.Load(dirName)
+    while not emulator.ram[7]:
+        emulator.Run(10000)
+    return emulator
+
+
+def Compare(name, dirName):
+    """
+    Run the program in 'dirName' with the .vm OS and with builtins,
+    and report the time and commands of each.
+    """
+    results = []
+    for builtins in ((), list(hvmBuiltins.BUILTINS)):
+        emulator = RunProgram(dirName, builtins)
+        results.append((emulator.seconds, emulator.steps,
+                        tuple(emulator.ram[6:8])))
+    ((vmSeconds, vmSteps, vmResult),
+     (nativeSeconds, nativeSteps, nativeResult)) = results
+    print('%s: .vm OS    %.3fs, %d commands' % (name, vmSeconds, vmSteps))
+    print('%s  builtins  %.3fs, %d commands' %
+          (' ' * len(name), nativeSeconds, nativeSteps))
+    print('%s  speedup %.1fx, result %s' %
+          (' ' * len(name), vmSeconds / nativeSeconds,
+           'identical' if vmResult == nativeResult else 'DIFFERENT'))
+
+
+def BenchArithmetic(dirName, count):
+    """
+    Math.multiply, divide, max and sqrt.
+    """
+    Generate(dirName, count, _arithmeticBody)
+    Compare('arithmetic', dirName)
+
+
+def BenchString(dirName, count):
+    """
+    String.new, setInt, appendChar, intValue and dispose, and the
+    Memory.alloc and deAlloc they call.
+    """
+    Generate(dirName, count, _stringBody)
+    Compare('string', dirName)
+
+
+def ParserCommands(fileName):
+    """
+    Returns the commands of 'fileName' read by hvmParser.Parser, as
+    (command type, arg1, arg2) tuples.
+    """
+    parser = Parser(fileName)
+    commands = []
+    while parser.Advance():
+        commands.append((parser.CommandType(), parser.Arg1(),
+                         int(parser.Arg2())))
+    parser.file.close()
+    return commands
+
+
+def BenchParse(dirName, count):
+    """
+    Reading the OS .vm files with Parser, with ReadCommands() and with
+    ReadCommands() when they are cached.
+    """
+    files = SourceFiles(_osDir)
+    expected = [ParserCommands(fileName) for fileName in files]
+    commandCount = sum([len(commands) for commands in expected])
+    print('parse: %d files, %d commands, %d rounds' %
+          (len(files), commandCount, _parseRounds))
+    for name in ('Parser', 'ReadCommands', 'cached'):
+        hvmParser.ClearCache()
+        start = time.perf_counter()
+        for _ in range(_parseRounds):
+            if name == 'Parser':
+                results = [ParserCommands(fileName) for fileName in files]
+                continue
+            if name == 'ReadCommands':
+                hvmParser.ClearCache()
+            results = [ReadCommands(fileName) for fileName in files]
+        seconds = time.perf_counter() - start
+        if name != 'Parser':
+            results = [[(command.commandType, command.arg1, command.arg2)
+                        for command in commands] for commands in results]
+        print('       %-13s %.3fs (%d commands/s), %s' %
+              (name, seconds, commandCount * _parseRounds / seconds,
+               'identical' if results == expected else 'DIFFERENT'))
+
+
+def Programs():
+    """
+    Returns (name, directory) for the programs of the size benchmark:
+    the OS, the Project_10 Memory test and the project 7 and 8 tests.
+    """
+    programs = [('OS', _osDir),
+                ('MemoryTest', os.path.join(os.path.dirname(
+                    os.path.abspath(__file__)), os.pardir, 'Project_10'))]
+    for project in ('7', '8'):
+        for (dirName, _, fileNames) in sorted(os.walk(os.path.join(
+                _projects, project))):
+            if [name for name in fileNames if name.endswith('.vm')]:
+                programs.append((os.path.basename(dirName), dirName))
+    return programs
+
+
+def RomWords(asmName):
+    """
+    Returns the number of instructions in Hack assembly file 'asmName'.
+    """
+    count = 0
+    with open(asmName) as file:
+        for line in file:
+            line = line.split('//')[0].strip()
+            if line and not line.startswith('('):
+                count += 1
+    return count
+
+
+def FunctionWords(asmName):
+    """
+    Returns a dict of the number of instructions in each function in
+    Hack assembly file 'asmName', by function name.  Code before the
+    first function is counted as '(bootstrap)', and the shared routines
+    as '(routines)'.
+    """
+    words = {}
+    name = '(bootstrap)'
+    with open(asmName) as file:
+        for line in file:
+            line = line.split('//')[0].strip()
+            if line.startswith('('):
+                label = line[1:-1]
+                if '.' in label and '$' not in label:
+                    name = label
+                elif label.startswith('$'):
+                    name = '(routines)'
+            elif line:
+                words[name] = words.get(name, 0) + 1
+    return words
+
+
+def Translate(dirName, options):
+    """
+    Translate the .vm files in 'dirName' with hvm.py and 'options', and
+    returns the ROM words of the output.
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'hvm.py')
+    if not os.path.exists(os.path.join(dirName, 'Sys.vm')):
+        options = ['-nosysinit'] + options
+    subprocess.run([sys.executable, script] + options + [dirName],
+                   stdout=subprocess.DEVNULL, check=True)
+    return os.path.join(dirName, os.path.basename(dirName)
+                        + os.path.extsep + 'asm')
+
+
+def Columns(base, values):
+    """
+    Returns the columns for 'values' and their change from 'base'.
+    """
+    return ''.join([' %8d (%5.1f%%)' % (value, 100 * (value - base) / base
+                                        if base else 0)
+                    for value in values])
+
+
+def OptionsHeader():
+    """
+    Returns the column headings for _codeOptions.
+    """
+    return ''.join([' %17s' % name for (name, _) in _codeOptions])
+
+
+def BenchSize(dirName, count):
+    """
+    ROM words of programs translated without options and with each of
+    the code generation options.
+    """
+    print('size: %-18s %7s' % ('program', 'words') + OptionsHeader())
+    totals = [0] * (len(_codeOptions) + 1)
+    for (name, sourceDir) in Programs():
+        programDir = os.path.join(dirName, name)
+        os.mkdir(programDir)
+        for fileName in SourceFiles(sourceDir):
+            shutil.copy(fileName, programDir)
+        sizes = [RomWords(Translate(programDir, options.split()))
+                 for (_, options) in [('', '')] + _codeOptions]
+        totals = [total + size for (total, size) in zip(totals, sizes)]
+        print('      %-18s %7d' % (name, sizes[0]) +
+              Columns(sizes[0], sizes[1:]))
+    print('      %-18s %7d' % ('total', totals[0]) +
+          Columns(totals[0], totals[1:]))
+
+
+def BenchFunctions(dirName, count):
+    """
+    ROM words of the largest OS functions translated without options
+    and with each of the code generation options.
+    """
+    programDir = os.path.join(dirName, 'OS')
+    shutil.copytree(_osDir, programDir)
+    sizes = [FunctionWords(Translate(programDir, options.split()))
+             for (_, options) in [('', '')] + _codeOptions]
+    names = sorted(sizes[0], key=lambda name: (-sizes[0][name], name))
+    print('functions: %-22s %6s' % ('function', 'words') + OptionsHeader())
+    for name in names[:_functionCount] + ['(routines)']:
+        base = sizes[0].get(name, 0)
+        print('           %-22s %6d' % (name, base) +
+              Columns(base, [words.get(name, 0) for words in sizes[1:]]))
+    print('           %d functions' % len(names))
+
+
+def Cycles(dirName, options):
+    """
+    Translate the program in 'dirName' with 'options' and run it on the
+    CPU emulator until temp 2 is set.  Returns (instructions executed,
+    to the nearest 100, and the program's results: temp 1, temp 2 and
+    the heap).
+    """
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 os.pardir, 'Project_05'))
+    import hcpu
+    cpu = hcpu.Cpu(True)
+    cpu.Load(Translate(dirName, options.split()))
+    while not cpu.ram[7]:
+        cpu.Run(100)
+    return (cpu.steps, (cpu.ram[6], cpu.ram[7], bytes(cpu.ram[2048:16384])))
+
+
+def BenchCycles(dirName, count):
+    """
+    Hack instructions executed by the arithmetic and string programs,
+    run 'count' / 10 times with the OS classes they use, translated
+    without options and with each of the code generation options.
+    DIFFERENT flags an option that changed the results.
+    """
+    print('cycles: %-16s %9s' % ('program', 'cycles') + OptionsHeader())
+    for (name, body) in (('arithmetic', _arithmeticBody),
+                         ('string', _stringBody)):
+        programDir = os.path.join(dirName, name)
+        os.mkdir(programDir)
+        Generate(programDir, max(count // 10, 1), body)
+        for className in ('Array', 'Math', 'Memory', 'String'):
+            shutil.copy(os.path.join(_osDir, className + os.path.extsep
+                                     + 'vm'), programDir)
+        results = [Cycles(programDir, options)
+                   for (_, options) in [('', '')] + _codeOptions]
+        cycles = [steps for (steps, _) in results]
+        same = [result for (_, result) in results] == \
+            [results[0][1]] * len(results)
+        print('        %-16s %9d' % (name, cycles[0]) +
+              Columns(cycles[0], cycles[1:]) +
+              ('' if same else ' DIFFERENT'))
+
+
+def BenchLocals(dirName, count):
+    """
+    Hack instructions executed by programs that call a function with
+    each of '_localCounts' locals 'count' / 10 times, translated
+    without options and with each of the code generation options.
+    DIFFERENT flags an option that changed the results.
+    """
+    print('locals: %-16s %9s' % ('locals', 'cycles') + OptionsHeader())
+    for numLocals in _localCounts:
+        programDir = os.path.join(dirName, str(numLocals))
+        os.mkdir(programDir)
+        Generate(programDir, max(count // 10, 1), _localsBody)
+        with open(os.path.join(programDir, 'Main.vm'), 'a') as file:
+            file.write(_localsFunction % (
+                numLocals,
+                '\n'.join(['push local %d\nadd' % i
+                           for i in range(numLocals)]),
+                '\n'.join(['push constant 7\npop local %d' % i
+                           for i in range(numLocals)])))
+        for className in ('Array', 'Math', 'Memory'):
+            shutil.copy(os.path.join(_osDir, className + os.path.extsep
+                                     + 'vm'), programDir)
+        results = [Cycles(programDir, options)
+                   for (_, options) in [('', '')] + _codeOptions]
+        cycles = [steps for (steps, _) in results]
+        same = [result for (_, result) in results] == \
+            [results[0][1]] * len(results)
+        print('        %-16d %9d' % (numLocals, cycles[0]) +
+              Columns(cycles[0], cycles[1:]) +
+              ('' if same else ' DIFFERENT'))
+
+
+def GenerateApp(dirName, copies):
+    """
+    Write a large program to 'dirName': the OS classes and 'copies'
+    copies of them, with the classes of copy n renamed Math<n>,
+    Memory<n> and so on, so that each copy calls its own classes.
+    """
+    classNames = [os.path.splitext(os.path.basename(fileName))[0]
+                  for fileName in SourceFiles(_osDir)]
+    for fileName in SourceFiles(_osDir):
+        shutil.copy(fileName, dirName)
+        className = os.path.splitext(os.path.basename(fileName))[0]
+        with open(fileName) as file:
+            source = file.read()
+        for n in range(1, copies + 1):
+            text = source
+            for name in classNames:
+                text = text.replace(name + '.', name + str(n) + '.')
+            with open(os.path.join(dirName, className + str(n) +
+                                   os.path.extsep + 'vm'), 'w') as file:
+                file.write(text)
+
+
+class UnbufferedWriter(hvm.CodeWriter):
+    """
+    A CodeWriter that writes each code fragment as it is made, as
+    CodeWriter did before it buffered its output.
+    """
+    def _WriteCode(self, code):
+        hvm.CodeWriter._WriteCode(self, code)
+        self._Flush()
+
+
+def TranslateInProcess(dirName, codeWriter):
+    """
+    Translate the .vm files in 'dirName' with 'codeWriter' and close it.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        codeWriter.WriteInit()
+        for fileName in SourceFiles(dirName):
+            hvm.Process(fileName, codeWriter)
+        codeWriter.Close()
+
+
+def TranslateTimes(dirName):
+    """
+    Returns the best times of translating 'dirName' to .asm unbuffered
+    and buffered, to .hack through a .asm file, and to .hack with the
+    code handed to the assembler in memory, the ROM words, and whether
+    the .asm and .hack outputs are the same each way.  The .hack files
+    are only compared if the code fits in the ROM, as the assemblers
+    wrap addresses past the end of it differently.
+    """
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 os.pardir, 'Project_05'))
+    import hasm
+    asmName = os.path.join(dirName, 'Out' + os.path.extsep + 'asm')
+    hackName = os.path.join(dirName, 'Out' + os.path.extsep + 'hack')
+
+    def Unbuffered():
+        TranslateInProcess(dirName, UnbufferedWriter(asmName))
+
+    def Buffered():
+        TranslateInProcess(dirName, hvm.CodeWriter(asmName))
+
+    def ThroughFile():
+        Buffered()
+        with contextlib.redirect_stdout(io.StringIO()):
+            hasm.Assembler().Assemble(asmName, hackName)
+
+    def InMemory():
+        outputFile = io.StringIO()
+        TranslateInProcess(dirName, hvm.CodeWriter(asmName, outputFile))
+        with contextlib.redirect_stdout(io.StringIO()):
+            hvm.Assemble(outputFile.getvalue(), hackName)
+
+    times = []
+    outputs = []
+    for (function, outName) in ((Unbuffered, asmName), (Buffered, asmName),
+                                (ThroughFile, hackName),
+                                (InMemory, hackName)):
+        best = None
+        for _ in range(_translateRounds):
+            start = time.perf_counter()
+            function()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best == None else min(best, elapsed)
+        times.append(best)
+        with open(outName) as file:
+            outputs.append(file.read())
+    words = outputs[2].count('\n')
+    return (times, words, outputs[0] == outputs[1] and
+            (outputs[2] == outputs[3] or words > 32768))
+
+
+def BenchTranslate(dirName, count):
+    """
+    Time translating the OS, and a large program of the OS and
+    'count' / 100 renamed copies of it, by hvm.py's code: to .asm
+    writing each code fragment as it is made and buffered, and to
+    .hack through a .asm file and with the code handed to the
+    assembler in memory.
+    """
+    print('translate: %-9s %8s %8s %10s %10s %10s %10s' %
+          ('program', 'commands', 'words', 'unbuffered', 'buffered',
+           'asm file', 'in memory'))
+    for (name, copies) in (('OS', 0), ('large', max(count // 100, 1))):
+        programDir = os.path.join(dirName, name)
+        os.mkdir(programDir)
+        GenerateApp(programDir, copies)
+        commands = sum([len(hvmParser.ReadCommands(fileName))
+                        for fileName in SourceFiles(programDir)])
+        (times, words, same) = TranslateTimes(programDir)
+        print('           %-9s %8d %8d' % (name, commands, words) +
+              ''.join([' %9.3fs' % seconds for seconds in times]) +
+              ('' if same else ' DIFFERENT'))
+
+
+def BenchParallel(dirName, count):
+    """
+    Time hvm.py translating the OS and the large program of the
+    translate benchmark, in one process and with -j for each of
+    '_jobCounts' workers.  DIFFERENT flags a worker count whose output
+    is not the same as with one worker.
+    """
+    print('parallel: %-9s %8s' % ('program', 'serial') +
+          ''.join([' %8s' % ('-j %d' % jobs) for jobs in _jobCounts]) +
+          '  (%d CPUs)' % os.cpu_count())
+    for (name, copies) in (('OS', 0), ('large', max(count // 100, 1))):
+        programDir = os.path.join(dirName, name)
+        os.mkdir(programDir)
+        GenerateApp(programDir, copies)
+        times = []
+        outputs = []
+        for options in [[]] + [['-j', str(jobs)] for jobs in _jobCounts]:
+            best = None
+            for _ in range(_translateRounds):
+                start = time.perf_counter()
+                asmName = Translate(programDir, options)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best == None else min(best, elapsed)
+            times.append(best)
+            with open(asmName) as file:
+                outputs.append(file.read())
+        print('          %-9s' % name +
+              ''.join([' %7.3fs' % seconds for seconds in times]) +
+              ('' if outputs[2:] == outputs[1:2] * (len(outputs) - 2)
+               else ' DIFFERENT'))
+
+
+benchmarks = {
+    'arithmetic': BenchArithmetic,
+    'string': BenchString,
+    'parse': BenchParse,
+    'size': BenchSize,
+    'functions': BenchFunctions,
+    'cycles': BenchCycles,
+    'locals': BenchLocals,
+    'translate': BenchTranslate,
+    'parallel': BenchParallel,
+    }
+
+
+def Usage():
+    print('usage: hvmBench [-n count] [benchmark ...]')
+    print('    benchmarks: ' + ' '.join(benchmarks))
+    sys.exit(-1)
+
+
+def Main():
+    count = 1000
+    while True:
+        if len(sys.argv) >= 3 and sys.argv[1] == '-n':
+            try:
+                count = int(sys.argv[2])
+            except ValueError:
+                Usage()
+            if not 0 < count < 32768:
+                Usage()
+            del (sys.argv[1:3])
+            continue
+        break
+
+    names = sys.argv[1:] or list(benchmarks)
+    for name in names:
+        if name not in benchmarks:
+            Usage()
+
+    for name in names:
+        with tempfile.TemporaryDirectory() as dirName:
+            benchmarks[name](dirName, count)
+
+
+if __name__ == '__main__':
+    Main()
@@ -0,0 +1,287 @@
+"""
+hvmBuiltins.py -- Native OS functions for Hack VM emulator
+
+Python versions of the OS functions that Jack programs spend most of
+their time in, like the Java VM emulator's builtInVMCode.  They work
+on the emulator's RAM, so their results and the objects they build
+are the same as the OS .vm code's.
+
+Each builtin is called with the emulator and the arguments as
+unsigned 16-bit values and returns the function's value, 0 for void
+functions.  An OS error raises BuiltinError, which the emulator turns
+into a call of Sys.error.  The errors and the order of their checks
+are those of the Java VM emulator's builtins, so Memory.alloc(0) is
+error 5 where the .vm code allocates one word.  An address outside
+the RAM raises AddressError, which stops the emulator.
+
+Some builtins share state or call each other, and can only replace
+the .vm code together; REQUIRES lists what enabling each one enables.
+The native Memory functions keep their own free list, so Memory.init,
+Memory.alloc and Memory.deAlloc are always native together.
+"""
+
+import math
+
+
+HEAP_BASE = 2048
+HEAP_END = 16384
+
+
+class BuiltinError(Exception):
+    """
+    Raised by a builtin for the OS error code 'args[0]'.
+    """
+    pass
+
+
+class AddressError(Exception):
+    """
+    Raised by a builtin for the illegal RAM address 'args[0]'.
+    """
+    pass
+
+
+def _Signed(x):
+    return x - 0x10000 if x & 0x8000 else x
+
+
+# Math
+
+def MathAbs(vm, x):
+    return abs(_Signed(x))
+
+
+def MathMultiply(vm, x, y):
+    return x * y
+
+
+def MathDivide(vm, x, y):
+    if y == 0:
+        raise BuiltinError(3)
+    (x, y) = (_Signed(x), _Signed(y))
+    quotient = abs(x) // abs(y)
+    return -quotient if (x < 0) != (y < 0) else quotient
+
+
+def MathMin(vm, x, y):
+    return min(_Signed(x), _Signed(y))
+
+
+def MathMax(vm, x, y):
+    return max(_Signed(x), _Signed(y))
+
+
+def MathSqrt(vm, x):
+    if x & 0x8000:
+        raise BuiltinError(4)
+    return math.isqrt(x)
+
+
+# Memory
+
+def MemoryInit(vm):
+    vm.heap = [(HEAP_BASE, HEAP_END - HEAP_BASE)]
+    return 0
+
+
+def MemoryPeek(vm, address):
+    if address & 0x8000:
+        raise AddressError(address)
+    return vm.ram[address]
+
+
+def MemoryPoke(vm, address, value):
+    if address & 0x8000:
+        raise AddressError(address)
+    vm.ram[address] = value
+    return 0
+
+
+def MemoryAlloc(vm, size):
+    # First fit.  The word before a block holds its size, for
+    # deAlloc().
+    size = _Signed(size)
+    if size <= 0:
+        raise BuiltinError(5)
+    size += 1
+    if vm.heap == None:
+        MemoryInit(vm)
+    for (i, (base, length)) in enumerate(vm.heap):
+        if length >= size:
+            if length == size:
+                del vm.heap[i]
+            else:
+                vm.heap[i] = (base + size, length - size)
+            vm.ram[base] = size
+            return base + 1
+    raise BuiltinError(6)
+
+
+def MemoryDeAlloc(vm, address):
+    # Return the block to the free list, which is kept in address
+    # order with adjacent blocks merged.
+    if vm.heap == None:
+        MemoryInit(vm)
+    base = address - 1
+    size = vm.ram[base]
+    heap = vm.heap
+    i = 0
+    while i < len(heap) and heap[i][0] < base:
+        i += 1
+    if i < len(heap) and base + size == heap[i][0]:
+        size += heap[i][1]
+        del heap[i]
+    if i > 0 and heap[i-1][0] + heap[i-1][1] == base:
+        (base, length) = heap[i-1]
+        size += length
+        i -= 1
+        del heap[i]
+    heap.insert(i, (base, size))
+    return 0
+
+
+# Array
+
+def ArrayNew(vm, size):
+    if size == 0 or size & 0x8000:
+        raise BuiltinError(2)
+    return MemoryAlloc(vm, size)
+
+
+def ArrayDispose(vm, this):
+    return MemoryDeAlloc(vm, this)
+
+
+# String objects are [maxLength, chars, length], as in the OS.
+
+def StringNew(vm, maxLength):
+    if maxLength & 0x8000:
+        raise BuiltinError(14)
+    this = MemoryAlloc(vm, 3)
+    ram = vm.ram
+    ram[this] = maxLength
+    ram[this+1] = ArrayNew(vm, maxLength) if maxLength else 0
+    ram[this+2] = 0
+    return this
+
+
+def StringDispose(vm, this):
+    if vm.ram[this] and not vm.ram[this] & 0x8000:
+        MemoryDeAlloc(vm, vm.ram[this+1])
+    return MemoryDeAlloc(vm, this)
+
+
+def StringLength(vm, this):
+    return vm.ram[this+2]
+
+
+def StringCharAt(vm, this, j):
+    ram = vm.ram
+    if _Signed(j) < 0 or _Signed(j) >= _Signed(ram[this+2]):
+        raise BuiltinError(15)
+    return ram[ram[this+1] + j]
+
+
+def StringSetCharAt(vm, this, j, c):
+    ram = vm.ram
+    if _Signed(j) < 0 or _Signed(j) >= _Signed(ram[this+2]):
+        raise BuiltinError(16)
+    ram[ram[this+1] + j] = c
+    return 0
+
+
+def StringAppendChar(vm, this, c):
+    ram = vm.ram
+    length = ram[this+2]
+    if length == ram[this]:
+        raise BuiltinError(17)
+    ram[ram[this+1] + length] = c
+    ram[this+2] = length + 1
+    return this
+
+
+def StringEraseLastChar(vm, this):
+    ram = vm.ram
+    if ram[this+2] == 0:
+        raise BuiltinError(18)
+    ram[this+2] -= 1
+    return 0
+
+
+def StringIntValue(vm, this):
+    ram = vm.ram
+    chars = ram[this+1]
+    length = ram[this+2]
+    value = 0
+    i = 0
+    negative = length > 0 and ram[chars] == ord('-')
+    if negative:
+        i = 1
+    while i < length and ord('0') <= ram[chars+i] <= ord('9'):
+        value = (value * 10 + ram[chars+i] - ord('0')) & 0xFFFF
+        i += 1
+    return -value if negative else value
+
+
+def StringSetInt(vm, this, number):
+    ram = vm.ram
+    text = str(_Signed(number))
+    if len(text) > _Signed(ram[this]):
+        raise BuiltinError(19)
+    chars = ram[this+1]
+    ram[chars:chars+len(text)] = [ord(c) for c in text]
+    ram[this+2] = len(text)
+    return 0
+
+
+def StringNewLine(vm):
+    return 128
+
+
+def StringBackSpace(vm):
+    return 129
+
+
+def StringDoubleQuote(vm):
+    return 34
+
+
+BUILTINS = {
+    'Math.abs': MathAbs,
+    'Math.multiply': MathMultiply,
+    'Math.divide': MathDivide,
+    'Math.min': MathMin,
+    'Math.max': MathMax,
+    'Math.sqrt': MathSqrt,
+    'Memory.init': MemoryInit,
+    'Memory.peek': MemoryPeek,
+    'Memory.poke': MemoryPoke,
+    'Memory.alloc': MemoryAlloc,
+    'Memory.deAlloc': MemoryDeAlloc,
+    'Array.new': ArrayNew,
+    'Array.dispose': ArrayDispose,
+    'String.new': StringNew,
+    'String.dispose': StringDispose,
+    'String.length': StringLength,
+    'String.charAt': StringCharAt,
+    'String.setCharAt': StringSetCharAt,
+    'String.appendChar': StringAppendChar,
+    'String.eraseLastChar': StringEraseLastChar,
+    'String.intValue': StringIntValue,
+    'String.setInt': StringSetInt,
+    'String.newLine': StringNewLine,
+    'String.backSpace': StringBackSpace,
+    'String.doubleQuote': StringDoubleQuote,
+    }
+
+_memory = ('Memory.init', 'Memory.alloc', 'Memory.deAlloc')
+
+REQUIRES = {
+    'Memory.init': _memory,
+    'Memory.alloc': _memory,
+    'Memory.deAlloc': _memory,
+    'Array.new': _memory,
+    'Array.dispose': _memory,
+    'String.new': _memory,
+    'String.dispose': _memory,
+    }
@@ -7,20 +7,65 @@ from hvmCommands import *
 
 debug = False
 
+# Command sequences that CodeWriter.WriteFused() writes as one, longest
+# first: (pattern, method name).  A pattern is a tuple of (command type,
+# allowed arg1 values or None for any).  The method is called with the
+# matching commands, and returns False if it does not handle them after
+# all.  A not is only fused after a comparison, whose result is 0 or -1;
+# on other values not is bitwise and is written as D=!D.
+_compare = ("eq", "gt", "lt")
+_not = ("not",)
+_branch = ((C_IF, None), (C_GOTO, None), (C_LABEL, None))
+fusedPatterns = [
+    (((C_ARITHMETIC, _compare), (C_ARITHMETIC, _not)) + _branch, "_FuseIf"),
+    (((C_ARITHMETIC, _compare),) + _branch, "_FuseIf"),
+    (((C_PUSH, None), (C_PUSH, ("constant",)),
+      (C_ARITHMETIC, ("add", "sub")), (C_POP, None)), "_FuseUpdate"),
+    (((C_ARITHMETIC, _compare), (C_ARITHMETIC, _not), (C_IF, None)),
+     "_FuseIf"),
+    (_branch, "_FuseIf"),
+    (((C_ARITHMETIC, _compare), (C_IF, None)), "_FuseIf"),
+    (((C_PUSH, ("constant",)), (C_ARITHMETIC, ("add", "sub"))),
+     "_FuseAddConstant"),
+    ]
+
+# Functions with up to this many locals clear them with straight line
+# code in compact locals mode; more use a loop.
+unrolledLocals = 8
+
 class CodeWriter(object):
     
-    def __init__(self, outputName):
+    def __init__(self, outputName, outputFile=None):
         """
         Open 'outputName' and gets ready to write it.
+        If 'outputFile', a file object, is given the code is written
+        to it instead, and Close() leaves it open.
+
+        The code is buffered and written one function at a time.
         """
-        self.file = open(outputName, 'w')
+        if outputFile == None:
+            self.file = open(outputName, 'w')
+            self.closeFile = True
+        else:
+            self.file = outputFile
+            self.closeFile = False
+        self.output = []
+        self.topInD = False
+        self.fileLabels = False
         self.SetFileName(outputName)
 
         self.labelNumber = 0
         self.callLabel = None
         self.cmpLabels = {}
+        self.sharedCompare = False
+        self.sharedCall = False
+        self.callRoutines = set()
+        self.cacheTop = False
+        self.specialize = False
+        self.fuse = False
+        self.compactLocals = False
         self.needHalt = True
-        self.functionNames = []
+        self.functionNames = set()
         
         # Starting points for memory segments
         # self.sp = 256
@@ -46,16 +91,86 @@ class CodeWriter(object):
         global debug
         debug = value
 
+    def SharedCompare(self, value):
+        """
+        Set shared comparison mode.
+        In shared comparison mode eq, gt and lt jump to one routine per
+        comparison, written after the halt, instead of being written in
+        line.
+        """
+        self.sharedCompare = value
+
+    def SharedCall(self, value):
+        """
+        Set shared call mode.
+        In shared call mode call and return jump to one call routine
+        and one return routine, written after the halt, instead of
+        being written in line.
+        """
+        self.sharedCall = value
+
+    def CacheTop(self, value):
+        """
+        Set top of stack caching mode.
+        In top of stack caching mode the value on top of the VM stack is
+        kept in D, instead of in RAM[SP-1], from one command to the next
+        within a basic block.  It is spilled to the stack before labels,
+        gotos, calls, returns and functions.
+        """
+        self.cacheTop = value
+
+    def Specialize(self, value):
+        """
+        Set specialized push and pop mode.
+        In specialized push and pop mode push and pop use the shortest
+        code for their segment and index: fixed addresses for static,
+        temp and pointer, A=M+1 steps for small offsets, and pops that
+        do not go through R13.  Top of stack caching mode always does.
+        """
+        self.specialize = value
+
+    def Fuse(self, value):
+        """
+        Set fused command mode.
+        In fused command mode, which needs top of stack caching mode,
+        WriteFused() writes the sequences in 'fusedPatterns' as one.
+        """
+        self.fuse = value
+
+    def CompactLocals(self, value):
+        """
+        Set compact locals mode.
+        In compact locals mode a function clears its locals with
+        M=0 / A=A+1 runs and one SP update, or with a loop for more than
+        'unrolledLocals' locals, instead of pushing 0 for each.
+        """
+        self.compactLocals = value
+
+    def FileLabels(self, value):
+        """
+        Set file label mode.
+        In file label mode _UniqueLabel() makes FileName$$n labels,
+        numbered from 1 in each file, so that a file's code does not
+        depend on the files translated before it.
+        """
+        self.fileLabels = value
+
     def Close(self):
         """
-        Write a jmp $ and close the output file.
+        Write a jmp $ and the comparison routines that were used, and
+        close the output file.
         """
+        self._Spill()
         if self.needHalt:
             if debug:
-                self.file.write('    // <halt>\n')
+                self.Write('    // <halt>')
             label = self._UniqueLabel()
             self._WriteCode('@%s, (%s), 0;JMP' % (label, label))
-        self.file.close()
+        self._WriteCompareRoutines()
+        self._WriteCallRoutines()
+        self._Flush()
+        if self.closeFile:
+            self.file.close()
 
 
     def SetFileName(self, fileName):
@@ -66,25 +181,67 @@ class CodeWriter(object):
         Strips the path and extension.  The resulting name must be a
         legal Hack Assembler identifier.
         """
+        self._Spill()
         if (debug):
-            self.file.write('    // File: %s\n' % (fileName))
+            self.Write('    // File: %s' % (fileName))
         self.fileName = os.path.basename(fileName)
         self.fileName = os.path.splitext(self.fileName)[0]
         self.functionName = None
+        if self.fileLabels:
+            self.labelNumber = 0
+
+    def EndFile(self):
+        """
+        Write out the code for the current file, without the halt and
+        shared routines that Close() writes, and leave the output file
+        open.  For a CodeWriter that translates a single file of a
+        program; see WriteTranslated().
+        """
+        self._Spill()
+        self._Flush()
+
+    def WriteTranslated(self, code, cmpLabels, callRoutines,
+                        functionNames):
+        """
+        Write 'code' translated by another CodeWriter in file label
+        mode, and the shared routines it uses, from its 'cmpLabels' and
+        'callRoutines', when closing.  Its 'functionNames' are checked
+        against the functions already written.
+        """
+        self._Spill()
+        self._Flush()
+        self.file.write(code)
+        self.cmpLabels.update(cmpLabels)
+        self.callRoutines.update(callRoutines)
+        for functionName in sorted(functionNames):
+            self._AddFunction(functionName)
+
+    def _AddFunction(self, functionName):
+        """
+        Note that 'functionName' is defined, and report it if it
+        already was.
+        """
+        if functionName in self.functionNames:
+            print('Function %s is defined more than once' % functionName)
+        self.functionNames.add(functionName)
 
 
     def Write(self, line):
         """
         Raw write for debug comments.
         """
+        self._Flush()
         self.file.write(line + '\n')
 
     def _UniqueLabel(self):
         """
         Make a globally unique label.
-        The label will be _sn where sn is an incrementing number.
+        The label will be _sn where sn is an incrementing number, or
+        FileName$$sn in file label mode.
         """
         self.labelNumber += 1
+        if self.fileLabels:
+            return self.fileName + '$$' + str(self.labelNumber)
         return '_' + str(self.labelNumber)
 
     # For functions
@@ -111,11 +268,219 @@ class CodeWriter(object):
     def _WriteCode(self, code):
         """
         Write the comma separated commands in 'code'.
+        The code is buffered until _Flush().
+        """
+        self.output.append(code)
+
+    def _Flush(self):
+        """
+        Write the buffered code to the output file, splitting the
+        commands onto lines.
         """
-        code = code.replace(', ', '\n')
-        self.file.write(code + '\n')
+        if self.output:
+            self.output.append('')
+            self.file.write('\n'.join(self.output).replace(', ', '\n'))
+            self.output = []
     
+    def _Spill(self):
+        """
+        Push the top of stack value in D, if it is cached there.
+        """
+        if self.topInD:
+            self._WriteCode("@0, AM=M+1, A=A-1, M=D")
+            self.topInD = False
+
+    def _WriteSpecializedPushPop(self, commandType, segment, index):
+        """
+        WritePushPop() for specialized push and pop and top of stack
+        caching modes.  Push loads the value into D, and pushes it unless
+        caching; pop stores D.
+        """
+        index = int(index)
+        bases = {"local": 1, "argument": 2, "this": 3, "that": 4}
+        addresses = {"pointer": 3, "temp": 5}
+        if commandType == C_PUSH:
+            self._WriteCode(f"// Pushing {segment} {index}")
+            self._Spill()
+            if segment == "constant" and index in (0, 1):
+                if not self.cacheTop:
+                    self._WriteCode(f"@0, AM=M+1, A=A-1, M={index}")
+                    return
+                self._WriteCode(f"D={index}")
+            elif segment == "constant":
+                self._WriteCode(f"@{index}, D=A")
+            elif segment == "static":
+                self._WriteCode(f"@{self._StaticLabel(index)}, D=M")
+            elif segment in addresses:
+                self._WriteCode(f"@{addresses[segment] + index}, D=M")
+            elif index == 0:
+                self._WriteCode(f"@{bases[segment]}, A=M, D=M")
+            elif index == 1:
+                self._WriteCode(f"@{bases[segment]}, A=M+1, D=M")
+            else:
+                self._WriteCode(f"@{index}, D=A, @{bases[segment]}, A=D+M, D=M")
+            self.topInD = True
+            if not self.cacheTop:
+                self._Spill()
+            return
+
+        self._WriteCode(f"// Popping to {segment} {index}")
+        if not self.topInD:
+            self._WriteCode("@0, AM=M-1, D=M")
+        self.topInD = False
+        address = self._Address(segment, index)
+        if address != None:
+            self._WriteCode(f"{address}, M=D")
+        else:
+            self._WriteCode(f"@R13, M=D, @{index}, D=A, @{bases[segment]}, D=D+M, @R14, M=D")
+            self._WriteCode("@R13, D=M, @R14, A=M, M=D")
+
+    def _Address(self, segment, index):
+        """
+        Returns code that sets A to the address of 'segment' 'index'
+        without changing D, or None if there is none.
+        """
+        bases = {"local": 1, "argument": 2, "this": 3, "that": 4}
+        addresses = {"pointer": 3, "temp": 5}
+        if segment == "static":
+            return f"@{self._StaticLabel(index)}"
+        if segment in addresses:
+            return f"@{addresses[segment] + index}"
+        if segment in bases and index <= 8:
+            # Step A to the address.
+            return f"@{bases[segment]}, A=M" + ", A=A+1" * index
+        return None
+
+    def _TopToD(self):
+        """
+        Pop the top of stack value into D and cache it, if it is not
+        already cached.
+        """
+        if not self.topInD:
+            self._WriteCode("@0, AM=M-1, D=M")
+            self.topInD = True
+
+    def WriteFused(self, commands, index):
+        """
+        Write the commands starting at commands[index] as one sequence
+        if they match one of 'fusedPatterns'.
+        Returns the number of commands written, 0 if none matched or
+        fused command mode is off.
+        """
+        if not (self.fuse and self.cacheTop):
+            return 0
+        for (pattern, method) in fusedPatterns:
+            window = commands[index:index + len(pattern)]
+            if len(window) != len(pattern):
+                continue
+            for (command, (commandType, arg1s)) in zip(window, pattern):
+                if command.commandType != commandType or \
+                        (arg1s != None and command.arg1 not in arg1s):
+                    break
+            else:
+                self._WriteCode("// Fused: " + "; ".join(map(str, window)))
+                if getattr(self, method)(window) != False:
+                    return len(pattern)
+        return 0
+
+    def _FuseIf(self, commands):
+        """
+        [compare [not]] if-goto A [goto B, label A]: one conditional
+        jump on D, or on x - y for a comparison, to A, or to B on the
+        opposite condition.
+        """
+        commands = list(commands)
+        jump = "JNE"
+        compare = None
+        if commands[0].commandType == C_ARITHMETIC and \
+                commands[0].arg1 in _compare:
+            compare = commands.pop(0).arg1
+            jump = "J" + compare.upper()
+        inverse = {"JNE": "JEQ", "JEQ": "JNE", "JGT": "JLE", "JLE": "JGT",
+                   "JLT": "JGE", "JGE": "JLT"}
+        if compare and commands[0].commandType == C_ARITHMETIC:
+            commands.pop(0)
+            jump = inverse[jump]
+        label = commands[0].arg1
+        if not label in self.functionNames:
+            label = self._LocalLabel(label)
+        if len(commands) == 3:
+            (ifGoto, goto, target) = commands
+            if target.arg1 != ifGoto.arg1:
+                return False
+            label = goto.arg1
+            if not label in self.functionNames and not "." in label:
+                label = self._LocalLabel(label)
+            jump = inverse[jump]
+
+        self._TopToD()
+        if compare:
+            self._WriteCode("@0, AM=M-1, D=M-D")
+        self._WriteCode(f"@{label}, D;{jump}")
+        self.topInD = False
+        if len(commands) == 3:
+            self.WriteLabel(target.arg1)
+
+    def _FuseUpdate(self, commands):
+        """
+        push X, push constant k, add or sub, pop X: X += k or X -= k in
+        place.
+        """
+        (push, constant, operation, pop) = commands
+        if (push.arg1, push.arg2) != (pop.arg1, pop.arg2):
+            return False
+        address = self._Address(pop.arg1, pop.arg2)
+        if address == None:
+            return False
+        self._Spill()
+        sign = "+" if operation.arg1 == "add" else "-"
+        if constant.arg2 == 1:
+            self._WriteCode(f"{address}, M=M{sign}1")
+        elif constant.arg2:
+            self._WriteCode(f"@{constant.arg2}, D=A, {address}, M=M{sign}D")
+
+    def _FuseAddConstant(self, commands):
+        """
+        push constant k, add or sub: D += k or D -= k.
+        """
+        (constant, operation) = commands
+        self._TopToD()
+        sign = "+" if operation.arg1 == "add" else "-"
+        if constant.arg2 == 1:
+            self._WriteCode(f"D=D{sign}1")
+        elif constant.arg2:
+            self._WriteCode(f"@{constant.arg2}, D=D{sign}A")
+
+    def _WriteCachedArithmetic(self, command):
+        """
+        WriteArithmetic() for top of stack caching mode.  The result is
+        left in D.
+        """
+        if command in ("neg", "not"):
+            operand = "D" if self.topInD else "M"
+            if not self.topInD:
+                self._WriteCode("@0, AM=M-1")
+            self._WriteCode(f"D={'-' if command == 'neg' else '!'}{operand}")
+            self.topInD = True
+            return
+
+        # D = y, then D = x op y with the SP pointing at x.
+        if not self.topInD:
+            self._WriteCode("@0, AM=M-1, D=M")
+        operations = {"add": "M+D", "sub": "M-D", "and": "D&M", "or": "D|M",
+                      "eq": "M-D", "gt": "M-D", "lt": "M-D"}
+        self._WriteCode(f"@0, AM=M-1, D={operations[command]}")
+        self.topInD = True
+        if command in ("eq", "gt", "lt"):
+            true_label = self._UniqueLabel()
+            end_label = self._UniqueLabel()
+            self._WriteCode(f"@{true_label}, D;J{command.upper()}, D=0, @{end_label}, 0;JMP")
+            self._WriteCode(f"({true_label}), D=-1, ({end_label})")
+
     def WritePushPop(self, commandType, segment, index):
+        if self.cacheTop or self.specialize:
+            self._WriteSpecializedPushPop(commandType, segment, index)
+            return
         def should_decrement_sp():
             skip_label = self._UniqueLabel()
             return f"@0, D=M, @256, D=D-A, @{skip_label}, D;JLE, @0, M=M-1, ({skip_label})" 
@@ -162,6 +527,16 @@ class CodeWriter(object):
     
     def WriteArithmetic(self, command):
         self._WriteCode(f"// Arithmetic: {command}")
+        if self.sharedCompare and command in ("eq", "gt", "lt"):
+            # The routine returns to the address in D.
+            self._Spill()
+            return_label = self._UniqueLabel()
+            self.cmpLabels[command] = "$" + command
+            self._WriteCode(f"@{return_label}, D=A, @{self.cmpLabels[command]}, 0;JMP, ({return_label})")
+            return
+        if self.cacheTop:
+            self._WriteCachedArithmetic(command)
+            return
         if not command in ("not", "neg"):
             self._WriteCode("@0, M=M-1")
         match command:
@@ -204,6 +579,41 @@ class CodeWriter(object):
             case "not":
                 self._WriteCode(f"@0, A=M-1, M=!M")
         
+    def _WriteCompareRoutines(self):
+        """
+        Write the shared routines for the comparisons in 'cmpLabels'.
+        A routine pops y and x, replaces them with x == y, x > y or
+        x < y as -1 or 0, and returns to the address that was in D.
+        """
+        jumps = {"eq": "JEQ", "gt": "JGT", "lt": "JLT"}
+        for command in sorted(self.cmpLabels):
+            label = self.cmpLabels[command]
+            self._WriteCode(f"// Comparison routine: {command}")
+            self._WriteCode(f"({label}), @R13, M=D")
+            self._WriteCode(f"@0, AM=M-1, D=M, A=A-1, D=M-D, M=-1, @{label}$true, D;{jumps[command]}")
+            self._WriteCode(f"@0, A=M-1, M=0, ({label}$true), @R13, A=M, 0;JMP")
+
+    def _WriteCallRoutines(self):
+        """
+        Write the shared call and return routines that were used.
+        The call routine is entered with the function's address in R13,
+        the number of arguments in R14 and the return address in D.
+        """
+        if "$call" in self.callRoutines:
+            self._WriteCode("// Call routine")
+            self._WriteCode("($call), @0, A=M, M=D")
+            self._WriteCode("@1, D=M, @0, AM=M+1, M=D")
+            self._WriteCode("@2, D=M, @0, AM=M+1, M=D")
+            self._WriteCode("@3, D=M, @0, AM=M+1, M=D")
+            self._WriteCode("@4, D=M, @0, AM=M+1, M=D")
+            self._WriteCode("@0, MD=M+1, @1, M=D")
+            self._WriteCode("@R14, D=D-M, @5, D=D-A, @2, M=D")
+            self._WriteCode("@R13, A=M, 0;JMP")
+        if "$return" in self.callRoutines:
+            self._WriteCode("// Return routine")
+            self._WriteCode("($return)")
+            self._WriteReturnCode()
+
     def WriteInit(self, sysinit = True):
         """
         Write the VM initialization code:
@@ -213,7 +623,7 @@ class CodeWriter(object):
             return
         
         if (debug):
-            self.file.write('    // Initialization code\n')
+            self.Write('    // Initialization code')
         self._WriteCode("// Initializing")
         self._WriteCode("@256, D=A, @0, M=D")
         self.WriteCall("Sys.init", 0)
@@ -225,6 +635,7 @@ class CodeWriter(object):
 	To be implemented as part of Project 7
 
         """
+        self._Spill()
         self._WriteCode(f"({self._LocalLabel(label)})")
 
     def WriteGoto(self, label):
@@ -240,6 +651,7 @@ class CodeWriter(object):
         if not label in self.functionNames and not "." in label:
             label = self._LocalLabel(label)
 
+        self._Spill()
         self._WriteCode(f"@{label}, 0;JMP")
 
     def WriteIf(self, label):
@@ -256,6 +668,10 @@ class CodeWriter(object):
             label = self._LocalLabel(label)
 
         self._WriteCode(f"// If-goto {label}")
+        if self.topInD:
+            self._WriteCode(f"@{label}, D;JNE")
+            self.topInD = False
+            return
         self._WriteCode(f"@0, M=M-1, A=M, D=M, @{label}, D;JNE")
 
     def WriteFunction(self, functionName, numLocals):
@@ -263,14 +679,44 @@ class CodeWriter(object):
         Write Hack code for 'function' VM command.
 	To be implemented as part of Project 7
         """
-        self.functionNames.append(functionName)
+        self._Spill()
+        self._Flush()
+        self._AddFunction(functionName)
         self._WriteCode(f"// Function {functionName}")
         self.functionName = functionName
 
         self._WriteCode(f"({functionName})")
+        if self.compactLocals:
+            self._WriteLocals(int(numLocals))
+            return
         for _ in range(int(numLocals)):
             self.WritePushPop(C_PUSH, "constant", 0)
 
+    def _WriteLocals(self, numLocals):
+        """
+        Push 'numLocals' zeros for compact locals mode.
+        """
+        if numLocals == 0:
+            return
+        self._WriteCode(f"// Clearing {numLocals} locals")
+        if numLocals <= 2:
+            for _ in range(numLocals):
+                self._WriteCode("@0, AM=M+1, A=A-1, M=0")
+        elif numLocals <= unrolledLocals:
+            self._WriteCode("@0, A=M" + ", M=0, A=A+1" * (numLocals - 1))
+            self._WriteCode("M=0, D=A+1, @0, M=D")
+        else:
+            # D counts down by 2 from numLocals, clearing SP+D-1 and
+            # SP+D-2, to 1 if numLocals is odd, and then SP+0.
+            odd = numLocals % 2
+            loop = self._UniqueLabel()
+            self._WriteCode(f"@{numLocals}, D=A, ({loop})")
+            self._WriteCode("@0, A=D+M, A=A-1, M=0, A=A-1, M=0")
+            self._WriteCode(f"@2, D=D-A, @{loop}, {'D-1' if odd else 'D'};JGT")
+            if odd:
+                self._WriteCode("@0, A=M, M=0")
+            self._WriteCode(f"@{numLocals}, D=A, @0, M=D+M")
+
 
     def WriteReturn(self):
         """
@@ -278,6 +724,14 @@ class CodeWriter(object):
 	To be implemented as part of Project 7
         """
         self._WriteCode("// Returning")
+        self._Spill()
+        if self.sharedCall:
+            self.callRoutines.add("$return")
+            self._WriteCode("@$return, 0;JMP")
+            return
+        self._WriteReturnCode()
+
+    def _WriteReturnCode(self):
         self._WriteCode("@1, D=M, @R13, M=D") # Save addr of frame to R13
         self._WriteCode("@5, D=A, @R13, D=M-D, A=D, D=M, @R14, M=D") # Save ret to R14
         self._WriteCode("@0, M=M-1, A=M, D=M, @2, A=M, M=D")
@@ -295,7 +749,13 @@ class CodeWriter(object):
 	To be implemented as part of Project 7
         """
         self._WriteCode(f"// Calling {functionName} with {numArgs} arguments")
+        self._Spill()
         return_label = self._UniqueLabel()
+        if self.sharedCall:
+            self.callRoutines.add("$call")
+            self._WriteCode(f"@{numArgs}, D=A, @R14, M=D, @{functionName}, D=A, @R13, M=D")
+            self._WriteCode(f"@{return_label}, D=A, @$call, 0;JMP, ({return_label})")
+            return
         self._WriteCode(f"@{return_label}, D=A, @0, A=M, M=D, @0, M=M+1")
         self._WriteCode("@1, D=M, @0, A=M, M=D, @0, M=M+1")
         self._WriteCode("@2, D=M, @0, A=M, M=D, @0, M=M+1")
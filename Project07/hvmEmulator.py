@@ -0,0 +1,533 @@
+#!/usr/bin/python3
+"""
+hvmEmulator.py -- VM emulator for Hack VM programs
+
+Runs .vm files directly, without translating them to Hack assembly.
+The RAM is laid out as the VM translator lays it out, so SP, LCL, ARG,
+THIS, THAT, the temp segment and the stack are at the same addresses
+and test scripts can check them.  Statics are not: each file's static
+i is at its base + i, the files' bases following each other from
+RAM[16] in load order, while the assembler gives the translated
+program's statics addresses in order of first reference.
+
+Loading reads the files with hvmParser.ReadCommands() and turns each
+command into an (opcode, x, y) tuple:
+    segments at fixed addresses (static, temp, pointer) become RAM
+    addresses;
+    labels are removed and goto and if-goto hold the index of the
+    command they jump to;
+    call holds the index of the function's first command.
+So Run() does no name lookups.
+
+Functions that the program calls but does not define are loaded from
+the OS .vm files in nand2tetris/tools/OS.  A program that has Main.main
+but no Sys.init starts in the OS Sys.init.
+
+Calls of the OS functions in hvmBuiltins.BUILTINS can instead run the
+Python versions there, selected with SetBuiltin().  A builtin call is
+one OP_BUILTIN command and counts as one step.
+"""
+
+import sys
+import os
+import time
+from hvmCommands import *
+from hvmParser import *
+from hvmBuiltins import *
+
+
+RAM_SIZE = 0x8000
+
+# Opcodes of the loaded program.
+OP_PUSH_CONSTANT = 0    # x = value
+OP_PUSH_SEGMENT = 1     # x = base pointer address, y = index
+OP_PUSH_ADDRESS = 2     # x = RAM address
+OP_POP_SEGMENT = 3      # x = base pointer address, y = index
+OP_POP_ADDRESS = 4      # x = RAM address
+OP_ADD = 5
+OP_SUB = 6
+OP_NEG = 7
+OP_EQ = 8
+OP_GT = 9
+OP_LT = 10
+OP_AND = 11
+OP_OR = 12
+OP_NOT = 13
+OP_GOTO = 14            # x = command index
+OP_IF = 15              # x = command index
+OP_CALL = 16            # x = command index, y = number of arguments
+OP_FUNCTION = 17        # x = number of locals
+OP_RETURN = 18
+OP_HALT = 19            # End of the program.
+OP_BUILTIN = 20         # x = builtin function, y = number of arguments
+
+_arithmeticOps = {
+    T_ADD: OP_ADD,
+    T_SUB: OP_SUB,
+    T_NEG: OP_NEG,
+    T_EQ: OP_EQ,
+    T_GT: OP_GT,
+    T_LT: OP_LT,
+    T_AND: OP_AND,
+    T_OR: OP_OR,
+    T_NOT: OP_NOT,
+    }
+
+# Base pointer addresses of the segments that have one.
+_segmentBases = {
+    T_LOCAL: 1,
+    T_ARGUMENT: 2,
+    T_THIS: 3,
+    T_THAT: 4,
+    }
+
+_osDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir,
+                      'nand2tetris', 'tools', 'OS')
+
+
+def FatalError(message):
+    """
+    Print an error message and abort.
+    """
+    print(message)
+    sys.exit(-1)
+
+
+def SourceFiles(sourceName):
+    """
+    Returns the .vm files named by 'sourceName', a file or a directory.
+    """
+    if not os.path.isdir(sourceName):
+        return [sourceName]
+    return [os.path.join(sourceName, name)
+            for name in sorted(os.listdir(sourceName))
+            if os.path.splitext(name)[1].lower() == os.path.extsep + 'vm']
+
+
+class Emulator(object):
+    # The test script command that executes one VM command.
+    stepCommand = 'vmstep'
+
+    def __init__(self, osDir=_osDir, builtins=()):
+        """
+        Constructor Emulator(osDir, builtins)
+        Functions the program does not define are loaded from the .vm
+        files in 'osDir'; None loads no OS.  The functions named in
+        'builtins' run as Python builtins.
+        """
+        self.osDir = osDir
+        self.ram = [0] * RAM_SIZE
+        self.program = [(OP_HALT, 0, 0)]
+        self.functions = {}     # Command index by function name.
+        self.calls = []         # (command index, function name)
+        self.builtins = set()
+        self.heap = None        # Free list of the native Memory.
+        for name in builtins:
+            self.SetBuiltin(name)
+        self.entry = 0
+        self.steps = 0
+        self.seconds = 0.0
+        self.Reset()
+
+
+    def Reset(self):
+        """
+        Start the program again: the next command is the entry point
+        and SP is 256.  The rest of the RAM is unchanged.
+        """
+        self.pc = self.entry
+        self.ram[0] = 256
+
+
+    def SetBuiltin(self, name, enabled=True):
+        """
+        Run OS function 'name' as a builtin, or as its .vm code if
+        'enabled' is False.  Builtins that depend on each other, see
+        hvmBuiltins.REQUIRES, are switched with it.  A loaded program
+        is relinked.
+        """
+        if name not in BUILTINS:
+            FatalError('No builtin ' + name)
+        if enabled:
+            self.builtins.add(name)
+            self.builtins.update(REQUIRES.get(name, ()))
+        else:
+            self.builtins -= set([other for other in self.builtins
+                                  if other == name or
+                                  name in REQUIRES.get(other, ())])
+        if self.calls:
+            self._Link()
+
+
+    def Load(self, sourceName):
+        """
+        Load the .vm file or directory of .vm files 'sourceName', and
+        the OS functions it needs, and reset the emulator.
+        """
+        self.program = []
+        self.functions = {}
+        self.staticBase = 16
+        self.heap = None
+        calls = []              # (command index, function name)
+        loaded = set()
+        native = set()          # Builtins with no .vm code.
+        files = SourceFiles(sourceName)
+        if not files:
+            FatalError('No .vm files in "' + sourceName + '"')
+        for fileName in files:
+            self._LoadFile(fileName, calls)
+            loaded.add(os.path.basename(fileName))
+
+        self.entry = 0
+        if 'Sys.init' not in self.functions and 'Main.main' in self.functions:
+            calls.append((None, 'Sys.init'))
+        while True:
+            missing = [name for (_, name) in calls
+                       if name not in self.functions and name not in native]
+            if not missing:
+                break
+            # Load the OS class of the first missing function.  The .vm
+            # code of builtins is loaded too when there is one, so they
+            # can be switched off.
+            fileName = missing[0].split('.')[0] + os.path.extsep + 'vm'
+            if self.osDir == None or fileName in loaded or \
+                    not os.path.exists(os.path.join(self.osDir, fileName)):
+                if missing[0] not in self.builtins:
+                    FatalError('Undefined function ' + missing[0])
+                native.add(missing[0])
+                continue
+            self._LoadFile(os.path.join(self.osDir, fileName), calls)
+            loaded.add(fileName)
+
+        self.calls = calls
+        self._Link()
+        if 'Sys.init' in self.functions:
+            self.entry = self.functions['Sys.init']
+        self.program.append((OP_HALT, 0, 0))
+        self.Reset()
+
+
+    def _Link(self):
+        # Point the call commands at their functions or builtins.
+        for (index, name) in self.calls:
+            if index == None:
+                continue
+            (_, _, argCount) = self.program[index]
+            if name in self.builtins:
+                self.program[index] = (OP_BUILTIN, BUILTINS[name], argCount)
+            elif name in self.functions:
+                self.program[index] = (OP_CALL, self.functions[name],
+                                       argCount)
+            else:
+                FatalError('Undefined function ' + name)
+
+
+    def _LoadFile(self, fileName, calls):
+        # Append the commands of 'fileName' to the program.  Calls are
+        # added to 'calls' to be resolved once all files are loaded.
+        try:
+            source = ReadCommands(fileName)
+        except OSError:
+            FatalError('Could not open source file "' + fileName + '"')
+        except ValueError as e:
+            FatalError(str(e))
+        className = os.path.splitext(os.path.basename(fileName))[0]
+        commands = []
+        labels = {}
+        gotos = []              # (command index, label)
+        statics = 0
+        functionName = className + '$'
+        for command in source:
+            commandType = command.commandType
+            arg1 = command.arg1
+            arg2 = command.arg2
+            index = len(self.program) + len(commands)
+            if commandType == C_ARITHMETIC:
+                commands.append((_arithmeticOps[arg1], 0, 0))
+            elif commandType in (C_PUSH, C_POP):
+                push = commandType == C_PUSH
+                if arg1 == T_CONSTANT and push:
+                    commands.append((OP_PUSH_CONSTANT, arg2 & 0xFFFF, 0))
+                    continue
+                if arg1 in _segmentBases:
+                    commands.append((OP_PUSH_SEGMENT if push
+                                     else OP_POP_SEGMENT,
+                                     _segmentBases[arg1], arg2))
+                    continue
+                if arg1 == T_STATIC:
+                    address = self.staticBase + arg2
+                    statics = max(statics, arg2 + 1)
+                elif arg1 == T_TEMP and arg2 < 8:
+                    address = 5 + arg2
+                elif arg1 == T_POINTER and arg2 < 2:
+                    address = 3 + arg2
+                else:
+                    FatalError('%s: bad segment %s %d' %
+                               (fileName, arg1, arg2))
+                commands.append((OP_PUSH_ADDRESS if push else OP_POP_ADDRESS,
+                                 address, 0))
+            elif commandType == C_LABEL:
+                labels[functionName + arg1] = index
+            elif commandType in (C_GOTO, C_IF):
+                gotos.append((len(commands), functionName + arg1))
+                commands.append((OP_GOTO if commandType == C_GOTO else OP_IF,
+                                 0, 0))
+            elif commandType == C_FUNCTION:
+                if arg1 in self.functions:
+                    FatalError('Multiple definition of function ' + arg1)
+                self.functions[arg1] = index
+                functionName = arg1 + '$'
+                commands.append((OP_FUNCTION, arg2, 0))
+            elif commandType == C_RETURN:
+                commands.append((OP_RETURN, 0, 0))
+            elif commandType == C_CALL:
+                calls.append((index, arg1))
+                commands.append((OP_CALL, 0, arg2))
+
+        for (position, label) in gotos:
+            if label not in labels:
+                FatalError('%s: undefined label %s' %
+                           (fileName, label.split('$', 1)[1]))
+            (op, _, _) = commands[position]
+            commands[position] = (op, labels[label], 0)
+        self.program.extend(commands)
+        self.staticBase += statics
+
+
+    def Run(self, steps):
+        """
+        Execute 'steps' VM commands.
+        The number of commands executed and the time taken are added to
+        self.steps and self.seconds.
+        """
+        start = time.perf_counter()
+        program = self.program
+        ram = self.ram
+        pc = self.pc
+        sp = ram[0]
+        # SP is kept in 'sp' and written back to RAM[0] before any
+        # access through a segment pointer, which could address it.
+        for _ in range(steps):
+            (op, x, y) = program[pc]
+            pc += 1
+            if op == OP_PUSH_CONSTANT:
+                ram[sp] = x
+                sp += 1
+            elif op == OP_PUSH_SEGMENT:
+                ram[0] = sp
+                ram[sp] = ram[ram[x] + y]
+                sp += 1
+            elif op == OP_POP_SEGMENT:
+                sp -= 1
+                address = ram[x] + y
+                ram[address] = ram[sp]
+                if address == 0:
+                    sp = ram[0]
+            elif op == OP_PUSH_ADDRESS:
+                ram[sp] = ram[x]
+                sp += 1
+            elif op == OP_POP_ADDRESS:
+                sp -= 1
+                ram[x] = ram[sp]
+            elif op == OP_ADD:
+                sp -= 1
+                ram[sp-1] = (ram[sp-1] + ram[sp]) & 0xFFFF
+            elif op == OP_SUB:
+                sp -= 1
+                ram[sp-1] = (ram[sp-1] - ram[sp]) & 0xFFFF
+            elif op == OP_IF:
+                sp -= 1
+                if ram[sp]:
+                    pc = x
+            elif op == OP_GOTO:
+                pc = x
+            elif op == OP_LT:
+                sp -= 1
+                ram[sp-1] = 0xFFFF if (ram[sp-1] ^ 0x8000) < \
+                    (ram[sp] ^ 0x8000) else 0
+            elif op == OP_GT:
+                sp -= 1
+                ram[sp-1] = 0xFFFF if (ram[sp-1] ^ 0x8000) > \
+                    (ram[sp] ^ 0x8000) else 0
+            elif op == OP_EQ:
+                sp -= 1
+                ram[sp-1] = 0xFFFF if ram[sp-1] == ram[sp] else 0
+            elif op == OP_NOT:
+                ram[sp-1] ^= 0xFFFF
+            elif op == OP_AND:
+                sp -= 1
+                ram[sp-1] &= ram[sp]
+            elif op == OP_OR:
+                sp -= 1
+                ram[sp-1] |= ram[sp]
+            elif op == OP_NEG:
+                ram[sp-1] = -ram[sp-1] & 0xFFFF
+            elif op == OP_CALL:
+                ram[sp] = pc
+                ram[sp+1] = ram[1]
+                ram[sp+2] = ram[2]
+                ram[sp+3] = ram[3]
+                ram[sp+4] = ram[4]
+                sp += 5
+                ram[2] = sp - y - 5
+                ram[1] = sp
+                pc = x
+            elif op == OP_FUNCTION:
+                if sp + x > RAM_SIZE:
+                    FatalError('Stack overflow')
+                ram[sp:sp+x] = [0] * x
+                sp += x
+            elif op == OP_BUILTIN:
+                sp -= y
+                ram[0] = sp
+                try:
+                    ram[sp] = x(self, *ram[sp:sp+y]) & 0xFFFF
+                    sp += 1
+                except BuiltinError as e:
+                    (sp, pc) = self._Error(e.args[0], sp, pc)
+                except AddressError as e:
+                    FatalError('Illegal memory address %d' %
+                               (e.args[0] - 0x10000))
+            elif op == OP_RETURN:
+                frame = ram[1]
+                pc = ram[frame-5]
+                argument = ram[2]
+                ram[argument] = ram[sp-1]
+                sp = argument + 1
+                ram[4] = ram[frame-1]
+                ram[3] = ram[frame-2]
+                ram[2] = ram[frame-3]
+                ram[1] = ram[frame-4]
+            else:
+                # OP_HALT: stay at the end of the program.
+                pc -= 1
+        ram[0] = sp
+        self.pc = pc
+        self.steps += steps
+        self.seconds += time.perf_counter() - start
+
+
+    def _Error(self, code, sp, pc):
+        # Call Sys.error(code) for a builtin that failed, as its .vm code
+        # would have, with the builtin's arguments popped.  Returns the
+        # new (sp, pc).
+        if 'Sys.error' not in self.functions:
+            FatalError('OS error %d' % code)
+        ram = self.ram
+        ram[sp] = code
+        ram[sp+1] = pc
+        ram[sp+2:sp+6] = ram[1:5]
+        ram[2] = sp
+        ram[1] = sp + 6
+        return (sp + 6, self.functions['Sys.error'])
+
+
+    def Get(self, name):
+        """
+        Returns the value of script variable 'name': sp, local,
+        argument, this, that, RAM[address] or segment[index] for
+        local, argument, this, that, temp and pointer.
+        """
+        return self.ram[self._Address(name)]
+
+
+    def Set(self, name, value):
+        """
+        Set script variable 'name' to 'value'.
+        """
+        self.ram[self._Address(name)] = value & 0xFFFF
+
+
+    def _Address(self, name):
+        # Returns the RAM address of script variable 'name'.
+        pointers = {'sp': 0, 'local': 1, 'argument': 2, 'this': 3,
+                    'that': 4}
+        if name in pointers:
+            return pointers[name]
+        if name.endswith(']') and '[' in name:
+            (segment, index) = name[:-1].split('[', 1)
+            try:
+                index = int(index)
+            except ValueError:
+                FatalError('Unknown variable ' + name)
+            if segment == 'RAM' and 0 <= index < RAM_SIZE:
+                return index
+            if segment in _segmentBases:
+                return self.ram[_segmentBases[segment]] + index
+            if segment == T_TEMP and 0 <= index < 8:
+                return 5 + index
+            if segment == T_POINTER and 0 <= index < 2:
+                return 3 + index
+        FatalError('Unknown variable ' + name)
+
+
+def Usage():
+    print('usage: hvmEmulator [-n steps] [-noos] [-builtin name] source')
+    print('    source is a .vm file or a directory of .vm files, which is')
+    print('    run for steps VM commands (default 1000000), or a .tst test')
+    print('    script.')
+    print('    -noos option does not load OS functions from')
+    print('    nand2tetris/tools/OS.')
+    print('    -builtin option runs OS function name, or all of them, as a')
+    print('    Python builtin.  May be repeated.')
+    sys.exit(-1)
+
+
+def Main():
+    try:
+        steps = 1000000
+        osDir = _osDir
+        builtins = []
+        while True:
+            if len(sys.argv) >= 3 and sys.argv[1] == '-builtin':
+                if sys.argv[2] == 'all':
+                    builtins.extend(BUILTINS)
+                elif sys.argv[2] in BUILTINS:
+                    builtins.append(sys.argv[2])
+                else:
+                    Usage()
+                del (sys.argv[1:3])
+                continue
+            if len(sys.argv) >= 2 and sys.argv[1] == '-noos':
+                osDir = None
+                del (sys.argv[1])
+                continue
+            if len(sys.argv) >= 3 and sys.argv[1] == '-n':
+                try:
+                    steps = int(sys.argv[2])
+                except ValueError:
+                    Usage()
+                del (sys.argv[1:3])
+                continue
+            break
+
+        if len(sys.argv) != 2:
+            Usage()
+
+        sourceName = sys.argv[1]
+        emulator = Emulator(osDir, builtins)
+        ok = True
+        if os.path.splitext(sourceName)[1].lower() == os.path.extsep + 'tst':
+            # Test scripts are run by the CPU emulator's script runner.
+            sys.path.append(os.path.join(os.path.dirname(
+                os.path.abspath(__file__)), os.pardir, 'Project_05'))
+            from hcpu import Script
+            ok = Script(sourceName, emulator).Run()
+            if ok:
+                print('Comparison ended successfully')
+        else:
+            emulator.Load(sourceName)
+            emulator.Run(steps)
+            print('SP = %d, next command %d' % (emulator.ram[0], emulator.pc))
+        print('%d steps in %.3fs (%d steps/s)' %
+              (emulator.steps, emulator.seconds,
+               emulator.steps / emulator.seconds if emulator.seconds else 0))
+        if not ok:
+            sys.exit(-1)
+
+    except SystemExit as e:
+        sys.exit(e)
+
+
+if __name__ == '__main__':
+    Main()
@@ -1,9 +1,149 @@
 """
 hvmParser.py -- Parser class for Hack VM translator
+
+Parser reads a .vm file a line at a time.  ReadCommands() parses a
+whole file in one pass into a tuple of Command records, and keeps the
+result so that reading the file again costs only a stat().  The
+results are kept in memory for the life of the process, for at most
+'cacheSize' files, the least recently read dropped first;
+ClearCache() drops them all.
 """
 
+import os
+import sys
+import hashlib
+import collections
 from hvmCommands import *
 
+_arithmetic = T_ARITHMETIC
+_commandTypes = {
+        "arithmetic": C_ARITHMETIC,
+        "push": C_PUSH,
+        "pop": C_POP,
+        "label": C_LABEL,
+        "goto": C_GOTO,
+        "if-goto": C_IF,
+        "function": C_FUNCTION,
+        "return": C_RETURN,
+        "call": C_CALL
+        }
+
+# (command type, number of arguments) by command word.
+_syntax = dict([(word, (C_ARITHMETIC, 0)) for word in T_ARITHMETIC] + [
+        (T_PUSH, (C_PUSH, 2)),
+        (T_POP, (C_POP, 2)),
+        (T_LABEL, (C_LABEL, 1)),
+        (T_GOTO, (C_GOTO, 1)),
+        (T_IF, (C_IF, 1)),
+        (T_FUNCTION, (C_FUNCTION, 2)),
+        (T_RETURN, (C_RETURN, 0)),
+        (T_CALL, (C_CALL, 2)),
+        ])
+
+# Command words by command type, for Command.__str__().
+_words = dict([(commandType, word) for (word, (commandType, _))
+               in _syntax.items() if commandType != C_ARITHMETIC])
+
+# Files whose ReadCommands() results are kept.
+cacheSize = 256
+
+# ReadCommands() results: ((mtime, size), SHA-1, commands) by path,
+# least recently read first.
+_cache = collections.OrderedDict()
+
+
+class Command(object):
+    """
+    A parsed VM command.  'arg1' is the command word for arithmetic
+    commands and return, and 'arg2' is an int, 0 if there is none.
+    """
+    __slots__ = ('commandType', 'arg1', 'arg2')
+
+    def __init__(self, commandType, arg1, arg2=0):
+        self.commandType = commandType
+        self.arg1 = arg1
+        self.arg2 = arg2
+
+    def __repr__(self):
+        return 'Command(%d, %r, %d)' % (self.commandType, self.arg1,
+                                        self.arg2)
+
+    def __str__(self):
+        if self.commandType in (C_ARITHMETIC, C_RETURN):
+            return self.arg1
+        if self.commandType in (C_LABEL, C_GOTO, C_IF):
+            return '%s %s' % (_words[self.commandType], self.arg1)
+        return '%s %s %d' % (_words[self.commandType], self.arg1, self.arg2)
+
+
+def ParseCommands(text, sourceName='<string>'):
+    """
+    Returns the commands in the VM source 'text' as a tuple of Command.
+    Raises ValueError for a line that is not a VM command.
+    """
+    commands = []
+    for (lineNumber, line) in enumerate(text.splitlines(), 1):
+        i = line.find('//')
+        if i != -1:
+            line = line[:i]
+        words = line.split()
+        if not words:
+            continue
+        (commandType, argCount) = _syntax.get(words[0], (None, -1))
+        if len(words) != argCount + 1:
+            raise ValueError('%s(%d): bad command "%s"' %
+                             (sourceName, lineNumber, line.strip()))
+        if argCount == 0:
+            commands.append(Command(commandType, sys.intern(words[0])))
+            continue
+        arg2 = 0
+        if argCount == 2:
+            try:
+                arg2 = int(words[2])
+            except ValueError:
+                raise ValueError('%s(%d): bad number "%s"' %
+                                 (sourceName, lineNumber, words[2]))
+        commands.append(Command(commandType, sys.intern(words[1]), arg2))
+    return tuple(commands)
+
+
+def ReadCommands(sourceName):
+    """
+    Returns the commands in .vm file 'sourceName' as a tuple of Command,
+    which must not be modified.  The file is parsed again only if its
+    modification time or size and its contents have changed since it
+    was last read.
+    Raises OSError if the file cannot be read, and ValueError as
+    ParseCommands().
+    """
+    path = os.path.abspath(sourceName)
+    status = os.stat(path)
+    stamp = (status.st_mtime_ns, status.st_size)
+    entry = _cache.get(path)
+    if entry and entry[0] == stamp:
+        _cache.move_to_end(path)
+        return entry[2]
+    with open(path, 'rb') as file:
+        data = file.read()
+    digest = hashlib.sha1(data).digest()
+    if entry and entry[1] == digest:
+        commands = entry[2]
+    else:
+        commands = ParseCommands(data.decode(), sourceName)
+    _cache[path] = (stamp, digest, commands)
+    _cache.move_to_end(path)
+    while len(_cache) > cacheSize:
+        _cache.popitem(last=False)
+    return commands
+
+
+def ClearCache():
+    """
+    Forget all the files read by ReadCommands().
+    """
+    _cache.clear()
+
+
 class Parser(object):
     def __init__(self, sourceName, comments=None):
         """
@@ -85,18 +225,8 @@ class Parser(object):
     """
 
     def _Parse(self):
-        arithmetic = ["add", "sub", "neg", "eq", "gt", "lt", "and", "or", "not"]
-        command_types = {
-                "arithmetic": C_ARITHMETIC,
-                "push": C_PUSH,
-                "pop": C_POP,
-                "label": C_LABEL,
-                "goto": C_GOTO,
-                "if-goto": C_IF,
-                "function": C_FUNCTION,
-                "return": C_RETURN,
-                "call": C_CALL
-                }
+        arithmetic = _arithmetic
+        command_types = _commandTypes
         # command [arg1 [arg2]]
         self.commandType = None  #this should store the type of the command
         self.arg1 = None         #this should store the first argument of the command (if there is a first argument)
@@ -5,135 +5,771 @@
 hasm.py -- Hack computer assembler
 
 See "The Elements of Computing Systems", by Noam Nisan and Shimon Schocken
+
+The assembler is the Assembler class; Main() is its command line.  An
+Assembler keeps no global state, so it can be used as a library:
+Assemble() assembles a file and Words() streams the code for source
+text given as a string or an iterable of lines.
 """
 
 import sys
 import os
+import io
+import contextlib
+import collections
+from concurrent.futures import ProcessPoolExecutor
 from hasmParser import *
 from hasmCode import *
 from hasmSymbols import *
+from hasmBinary import *
+from hasmCache import *
+from hasmPeephole import *
 from hasmError import *
 
         
-def Pass1(sourceFile):
-    global symbolTable, address
-    parser = Parser(sourceFile)
-
-    while parser.Advance():
-        commandType = parser.CommandType()
-        if commandType == NO_COMMAND:
-            pass
-        elif commandType in (A_COMMAND, C_COMMAND):
-            address += 1
-        elif commandType == L_COMMAND:
-            pass
-#################################################################################
-# To be completed:
-#  Each time a pseudo command (Xxx) is encountered, add a new entry to the symbol table,            
-#  assocating Xxx with the ROM address that will store the next command in the program.
-#  
-#  Provide error message for multiple definitions and invalid symbol name. 
-#  The error message should be written in the output file and have a form #Error: "reason of error" 
-#
-#  Insert your code instead of pass above.
-#################################################################################
-                
-
-def Pass2(sourceFile):
-    global outFile
-    global symbolTable, address, ramAddress
-    parser = Parser(sourceFile)
-    coder = Code()
-
-    while parser.HasMoreCommands():
-        parser.Advance()
-        commandType = parser.CommandType()
-        
-        if commandType == NO_COMMAND:
-            pass
-
-        elif commandType == A_COMMAND:
-            symbol = parser.Symbol()
-            try:
-                value = int(symbol)
-            except:
-                if symbolTable.Contains(symbol):
-                    value = symbolTable.GetAddress(symbol)
-                elif symbolTable.AddEntry(symbol, ramAddress):
-                    value = ramAddress
-                    ramAddress += 1
+class Assembler(object):
+
+    def __init__(self, onePass=False, binaryOrder=None, cacheDir=None,
+                 optimize=False):
+        """
+        Constructor Assembler(onePass, binaryOrder, cacheDir, optimize)
+
+        'onePass' assembles reading the source only once.
+        'binaryOrder' is None for text .hack output, or LITTLE_ENDIAN or
+        BIG_ENDIAN for a binary image.
+        'cacheDir' keeps encoded sources in an on-disk cache in that
+        directory.  Implies 'onePass'.
+        'optimize' runs the peephole optimizer.  Implies 'onePass'.
+        The number of instructions it removed from the last source is
+        kept in 'removed'.
+        """
+        self.onePass = onePass or cacheDir != None or optimize
+        self.byteOrder = binaryOrder
+        self.cache = Cache(cacheDir) if cacheDir != None else None
+        self.optimize = optimize
+        self.removed = 0
+
+
+    def Assemble(self, sourceName, outName, listName=None, mapName=None):
+        """
+        Assemble file 'sourceName' into 'outName'.
+        If 'listName' or 'mapName' are given, a listing file and a
+        symbol map are written as well.
+        Returns (code size, data size).
+        """
+        self.outName = outName
+        self.listName = listName
+        self.listing = [] if listName != None else None
+        self.variables = []
+        self.symbolTable = Symbols()
+        self.removed = 0
+        self.ok = True          # Cleared when a pass reports an error.
+
+        if self.onePass:
+            self.address = 0
+            self.ramAddress = 0x10
+            self.OnePass(sourceName)
+        else:
+            self.address = 0
+            self.Pass1(sourceName)
+
+            self.address = 0
+            self.ramAddress = 0x10
+            self.Pass2(sourceName)
+
+        if mapName != None:
+            self.WriteSymbolMap(mapName)
+        return (self.address, self.ramAddress)
+
+
+    def Words(self, source):
+        """
+        Generator of the instruction codes, as integers, for 'source',
+        a string or an iterable of lines.
+
+        Lines are parsed as they are read and each code is yielded as
+        soon as it is known.  A reference to a symbol that is not yet
+        defined holds back the codes that follow it until the symbol is
+        defined as a label, or, for variables, until the end of the
+        source.  With 'optimize' the whole source is read first.
+
+        The generator's return value is (code size, data size).
+        Commands with errors are reported and yield 0x7FFF or the code
+        with the bad fields as 0.  The cache is not used.
+        """
+        if isinstance(source, str):
+            source = io.StringIO(source)
+        parser = BufferParser('<stream>', '')
+        records = parser.StreamRecords(source)
+        self.removed = 0
+        if self.optimize:
+            (records, self.removed) = Optimize(list(records))
+
+        symbolTable = Symbols()
+        lookup = symbolTable.Lookup
+        coder = Code()
+        command = coder.Command
+        pending = []    # Codes not yet yielded, None if unresolved.
+        head = 0        # Index in 'pending' of the next code to yield.
+        base = 0        # Address of pending[0].
+        refs = collections.OrderedDict()  # Unresolved symbol: addresses
+        address = 0
+
+        for (commandType, symbol, dest, comp, jump, lineNumber) in records:
+            if commandType == C_COMMAND:
+                value = command(dest, comp, jump)
+                if value == None:
+                    value = self.CCommand(coder, dest, comp, jump,
+                                          lineNumber, '')
+                    value = int(value.replace('?', '0'), 2)
+                if head == len(pending):
+                    yield value
+                    base += 1
+                else:
+                    pending.append(value)
+                address += 1
+
+            elif commandType == A_COMMAND:
+                try:
+                    value = int(symbol)
+                except:
+                    value = lookup(symbol)
+                    if value == None:
+                        refs.setdefault(symbol, []).append((address,
+                                                            lineNumber))
+                if value != None and head == len(pending):
+                    yield value & 0x7FFF
+                    base += 1
                 else:
+                    pending.append(value if value == None else value & 0x7FFF)
+                address += 1
+
+            elif commandType == L_COMMAND:
+                if symbolTable.Contains(symbol):
+                    Error('Multiple definition of symbol ' + symbol,
+                          lineNumber)
+                elif not symbolTable.AddEntry(symbol, address):
+                    Error('Invalid symbol name ' + symbol, lineNumber)
+                elif symbol in refs:
+                    for (codeAddress, _) in refs.pop(symbol):
+                        pending[codeAddress - base] = address
+                    # Yield the codes that are no longer held back.
+                    while head < len(pending) and pending[head] != None:
+                        yield pending[head]
+                        head += 1
+                    if head == len(pending) or head > 4096:
+                        del pending[:head]
+                        base += head
+                        head = 0
+
+        # Whatever is still unresolved is a variable.  'refs' is in
+        # order of first reference, the order Pass2() allocates them.
+        ramAddress = 0x10
+        for (symbol, addresses) in refs.items():
+            if symbolTable.AddEntry(symbol, ramAddress):
+                value = ramAddress
+                ramAddress += 1
+            else:
+                Error('Invalid symbol name ' + symbol, addresses[0][1])
+                value = 0x7FFF
+            for (codeAddress, _) in addresses:
+                pending[codeAddress - base] = value
+        for value in pending[head:]:
+            yield value
+        return (address, ramAddress)
+
+
+    def Pass1(self, sourceFile):
+        parser = Parser(sourceFile)
+
+        while parser.Advance():
+            commandType = parser.CommandType()
+            if commandType == NO_COMMAND:
+                pass
+            elif commandType in (A_COMMAND, C_COMMAND):
+                self.address += 1
+            elif commandType == L_COMMAND:
+                symbol = parser.Symbol()
+                if self.symbolTable.Contains(symbol):
+                    Error('Multiple definition of symbol ' + symbol,
+                          parser.LineNo(), parser.Line())
+                    self.ok = False
+                elif not self.symbolTable.AddEntry(symbol, self.address):
                     Error('Invalid symbol name ' + symbol,
                           parser.LineNo(), parser.Line())
-                    value = 0x7FFF
-            code = value & 0x7FFF
-            outFile.write(Int2Bin(code)+'\n')
-            address += 1
+                    self.ok = False
+
+
+    def Pass2(self, sourceFile):
+        parser = Parser(sourceFile)
+        coder = Code()
+        code = []
+
+        while parser.HasMoreCommands():
+            parser.Advance()
+            commandType = parser.CommandType()
+        
+            if commandType == NO_COMMAND:
+                pass
+
+            elif commandType == A_COMMAND:
+                symbol = parser.Symbol()
+                try:
+                    value = int(symbol)
+                except:
+                    value = self.Variable(symbol)
+                    if value == None:
+                        Error('Invalid symbol name ' + symbol,
+                              parser.LineNo(), parser.Line())
+                        self.ok = False
+                        value = 0x7FFF
+                code.append(value & 0x7FFF)
+                if self.listing != None:
+                    self.listing.append((self.address, True, parser.LineNo(),
+                                         parser.Line()))
+                self.address += 1
            
-        elif commandType == C_COMMAND:
-            dest = coder.Dest(parser.Dest())
-            if dest == None:
-               Error('unknown destination field: ' + parser.Dest(),
-                     parser.LineNo(), parser.Line())
-               dest='???'
-            comp = coder.Comp(parser.Comp())
-            if comp == None:
-               Error('unknown computation field: ' + parser.Comp(),
-                     parser.LineNo(), parser.Line())
-               comp='???????'
-            jump = coder.Jump(parser.Jump())
-            if jump == None:
-               Error('unknown jump field: ' + parser.Jump(),
-                     parser.LineNo(), parser.Line())
-               jump='???'
-            bin = ('111' + comp + dest + jump)
-            outFile.write(bin+'\n')
-            address += 1
+            elif commandType == C_COMMAND:
+                value = self.CCommand(coder, parser.Dest(), parser.Comp(),
+                                      parser.Jump(), parser.LineNo(),
+                                      parser.Line())
+                if type(value) is not int:
+                    self.ok = False
+                code.append(value)
+                if self.listing != None:
+                    self.listing.append((self.address, True, parser.LineNo(),
+                                         parser.Line()))
+                self.address += 1
             
-        elif commandType == L_COMMAND:
-            pass
+            elif commandType == L_COMMAND:
+                if self.listing != None:
+                    self.listing.append((self.address, False, parser.LineNo(),
+                                         parser.Line()))
 
+        self.WriteCode(code)
 
-def Int2Bin(i):
-    bin = ''
-    while i:
-        if i & 1:
-            bin = '1' + bin
+
+    def OnePass(self, sourceFile):
+        """
+        Assemble 'sourceFile' reading the source only once.
+
+        The source is tokenized by a BufferParser and its command
+        records are encoded into an in-memory list.  A-commands that
+        refer to a symbol are left as fixups; once all labels have been
+        entered in the symbol table they are backpatched in source
+        order, allocating variables in the same order as Pass2() does.
+        The output is identical to Pass1() followed by Pass2().
+
+        If a cache is in use, the encoded source is taken from the cache
+        where possible and only the symbols are resolved.  The resolved
+        symbol table is cached too, so that assembling an unchanged
+        source starts with all its labels and variables already entered.
+        """
+        parser = BufferParser(sourceFile)
+        snapshot = None
+        if self.cache != None:
+            (regions, sourceKey) = self.CachedRegions(parser, sourceFile)
+            symbolsKey = Key('symbols:' + sourceKey)
+            snapshot = self.cache.Load(symbolsKey)
+        else:
+            records = self.Records(parser, 0, len(parser.buffer), 1)
+            regions = [(1, None, self.Encode(parser, records, 1))]
+        ok = all(region[4] for (_, _, region) in regions)
+
+        # Enter the labels.
+        if snapshot != None:
+            (symbols, self.variables, self.ramAddress) = snapshot
+            self.symbolTable.Restore(symbols)
+        code = []
+        bases = []
+        for (firstLine, _, (words, lines, labels, refs, _)) in regions:
+            base = len(code)
+            bases.append(base)
+            code.extend(words)
+            if snapshot != None:
+                continue
+            for (index, symbol, line) in labels:
+                lineNumber = firstLine + line
+                if self.symbolTable.Contains(symbol):
+                    Error('Multiple definition of symbol ' + symbol,
+                          lineNumber, parser.SourceLine(lineNumber))
+                    ok = False
+                elif not self.symbolTable.AddEntry(symbol, base + index):
+                    Error('Invalid symbol name ' + symbol,
+                          lineNumber, parser.SourceLine(lineNumber))
+                    ok = False
+        self.address = len(code)
+
+        # Backpatch the symbol references.  Variables are allocated as
+        # they are first referenced.
+        variable = self.Variable
+        for ((firstLine, _, (words, lines, labels, refs, _)), base) in \
+                zip(regions, bases):
+            for (index, symbol) in refs:
+                value = variable(symbol)
+                if value == None:
+                    lineNumber = firstLine + lines[index]
+                    Error('Invalid symbol name ' + symbol,
+                          lineNumber, parser.SourceLine(lineNumber))
+                    ok = False
+                    value = 0x7FFF
+                code[base + index] = value & 0x7FFF
+
+        # The source is still in the parser's buffer; no need to read it
+        # again for the listing.
+        if self.listing != None:
+            for ((firstLine, _, (words, lines, labels, refs, _)), base) in \
+                    zip(regions, bases):
+                for (index, line) in enumerate(lines):
+                    self.listing.append((base + index, True, firstLine + line,
+                                         parser.SourceLine(firstLine + line)))
+                for (index, symbol, line) in labels:
+                    self.listing.append((base + index, False, firstLine + line,
+                                         parser.SourceLine(firstLine + line)))
+            self.listing.sort(key=lambda entry: entry[2])
+
+        # Sources with errors are not cached so that the errors are
+        # reported every time.
+        if self.cache != None and snapshot == None and ok:
+            self.cache.Store(symbolsKey, (self.symbolTable.Snapshot(),
+                                          self.variables, self.ramAddress))
+
+        self.ok = self.ok and ok
+        self.WriteCode(code)
+
+
+    def Encode(self, parser, records, firstLine):
+        """
+        Encode a list of BufferParser records.  Symbols are not
+        resolved.
+
+        Returns (words, lines, labels, refs, ok):
+        'words' is the list of instruction codes, with 0 for A-commands
+        that refer to a symbol;  'lines' has the source line of each
+        word;  'labels' is a list of (word index, symbol, line) for the
+        labels;  'refs' is a list of (word index, symbol) for the
+        A-commands that refer to a symbol;  'ok' is False if an error
+        was reported.  Line numbers are relative to line 'firstLine'.
+        """
+        coder = Code()
+        command = coder.Command
+        words = []
+        lines = []
+        labels = []
+        refs = []
+        ok = True
+
+        for (commandType, symbol, dest, comp, jump, lineNumber) in records:
+            if commandType == C_COMMAND:
+                value = command(dest, comp, jump)
+                if value == None:
+                    value = self.CCommand(coder, dest, comp, jump, lineNumber,
+                                          parser.SourceLine(lineNumber))
+                    ok = False
+                words.append(value)
+                lines.append(lineNumber - firstLine)
+
+            elif commandType == A_COMMAND:
+                try:
+                    value = int(symbol) & 0x7FFF
+                except:
+                    refs.append((len(words), symbol))
+                    value = 0
+                words.append(value)
+                lines.append(lineNumber - firstLine)
+
+            elif commandType == L_COMMAND:
+                labels.append((len(words), symbol, lineNumber - firstLine))
+
+        return (words, lines, labels, refs, ok)
+
+
+    def Records(self, parser, start, end, firstLine):
+        """
+        Returns the records of the parser's source from offset 'start'
+        to 'end', which starts at line 'firstLine'.  The records are
+        passed through the peephole optimizer if it is enabled.
+        """
+        records = parser.Tokenize(start, end, firstLine)
+        if self.optimize:
+            (records, removed) = Optimize(records)
+            self.removed += removed
+        return records
+
+
+    def CachedRegions(self, parser, sourceFile):
+        """
+        Returns (regions, key): the parser's source encoded by regions,
+        as a list of (first line, region key, encoded region), and the
+        source's cache key.  Each region starts at a label, see
+        BufferParser.Regions().
+
+        The whole list is cached by the source text.  If the source has
+        changed, regions that are unchanged since the last version of
+        'sourceFile' seen by the cache are reused and only the changed
+        ones are encoded.
+
+        When optimizing, the source is one region, as the optimizer
+        works across labels, and optimized regions are cached
+        separately.
+        """
+        prefix = 'optimize:' if self.optimize else ''
+        key = Key(prefix + parser.buffer)
+        pathKey = Key(prefix + 'path:' + os.path.abspath(sourceFile))
+        regions = self.cache.Load(key)
+        if regions != None:
+            if self.cache.Load(pathKey) != key:
+                self.cache.Store(pathKey, key)
+            return (regions, key)
+
+        previous = {}
+        previousKey = self.cache.Load(pathKey)
+        if previousKey != None:
+            for (_, regionKey, region) in self.cache.Load(previousKey) or []:
+                previous[regionKey] = region
+
+        regions = []
+        ok = True
+        if self.optimize:
+            sourceRegions = [(0, len(parser.buffer), 1)]
         else:
-            bin = '0' + bin
-        i //= 2
-    bin = '0' * 16 + bin
-    return bin[-16:]
+            sourceRegions = parser.Regions()
+        for (start, end, firstLine) in sourceRegions:
+            regionKey = Key(parser.buffer[start:end])
+            region = previous.get(regionKey)
+            if region == None:
+                records = self.Records(parser, start, end, firstLine)
+                region = self.Encode(parser, records, firstLine)
+                ok = ok and region[4]
+            regions.append((firstLine, regionKey, region))
+
+        # Sources with errors are not cached so that the errors are
+        # reported every time.
+        if ok:
+            self.cache.Store(key, regions)
+            self.cache.Store(pathKey, key)
+        return (regions, key)
+
+
+    def Variable(self, symbol):
+        """
+        Returns the address of 'symbol', allocating the next RAM address
+        to it as a variable if it is not in the symbol table.
+        Returns None if 'symbol' is not a legal symbol name.
+        """
+        (value, added) = self.symbolTable.LookupOrAdd(symbol, self.ramAddress)
+        if added:
+            self.variables.append(symbol)
+            self.ramAddress += 1
+        return value
+
+
+    def CCommand(self, coder, dest, comp, jump, lineNumber, line):
+        """
+        Return the code of the C-command dest=comp;jump as an integer.
+
+        If the command cannot be encoded, errors are reported for
+        'lineNumber' and 'line', and the returned code is a string with
+        '?'s in place of the bad fields.
+        """
+        code = coder.Command(dest, comp, jump)
+        if code != None:
+            return code
+        destBits = coder.Dest(dest)
+        if destBits == None:
+           Error('unknown destination field: ' + dest, lineNumber, line)
+           destBits = '???'
+        compBits = coder.Comp(comp)
+        if compBits == None:
+           Error('unknown computation field: ' + comp, lineNumber, line)
+           compBits = '???????'
+        jumpBits = coder.Jump(jump)
+        if jumpBits == None:
+           Error('unknown jump field: ' + jump, lineNumber, line)
+           jumpBits = '???'
+        return '111' + compBits + destBits + jumpBits
+
+
+    def WriteCode(self, code):
+        """
+        Write the list of instruction codes 'code' to the output file,
+        one 16-digit binary word per line, or as a binary image if a
+        byte order has been selected.
+        Writes the listing file too if one has been requested.
+        If the passes reported errors nothing is written and the
+        assembly is aborted.
+        """
+        if not self.ok:
+            FatalError('Errors in source, "' + self.outName +
+                       '" not written')
+        if self.listing != None:
+            self.WriteListing(code)
+        if self.byteOrder != None:
+            WriteBinary(self.outName, code, self.ramAddress, self.byteOrder)
+            return
+        try:
+            file = open(self.outName, 'w')
+        except:
+            FatalError('Could not open output file "' + self.outName + '"')
+        with file:
+            file.write(''.join([Int2Bin(word) + '\n' for word in code]))
+
+
+    def WriteListing(self, code):
+        """
+        Write the listing file.  Each line shows the ROM address, the
+        binary code and the line number and text of a source line.
+        Labels show the ROM address they refer to and no code.
+        """
+        try:
+            file = open(self.listName, 'w')
+        except:
+            FatalError('Could not open listing file "' + self.listName + '"')
+        with file:
+            file.write('ROM   Code               Line  Source\n')
+            for (codeAddress, isCommand, lineNumber, line) in self.listing:
+                if isCommand:
+                    word = Int2Bin(code[codeAddress])
+                else:
+                    word = ''
+                file.write('%04X  %-16s %6d  %s\n' % (codeAddress, word,
+                                                      lineNumber, line))
+
+
+    def WriteSymbolMap(self, mapName):
+        """
+        Write symbol map file 'mapName': the labels with their ROM
+        addresses followed by the variables with their RAM addresses.
+        Built-in symbols are not included.
+        """
+        builtIn = Symbols.builtIn
+        isVariable = set(self.variables)
+        labels = sorted((address, symbol) for (symbol, address)
+                        in self.symbolTable.symbolDict.items()
+                        if symbol not in builtIn and symbol not in isVariable)
+        try:
+            file = open(mapName, 'w')
+        except:
+            FatalError('Could not open symbol map file "' + mapName + '"')
+        with file:
+            for (address, symbol) in labels:
+                file.write('ROM %04X %s\n' % (address, symbol))
+            for symbol in self.variables:
+                file.write('RAM %04X %s\n' %
+                           (self.symbolTable.GetAddress(symbol), symbol))
+
+
+# 8-digit binary text of every byte value.  Words are rendered as two
+# table lookups, for both A-command and C-command codes.
+_byteBin = tuple(format(i, '08b') for i in range(256))
+
+
+def Int2Bin(i):
+    """
+    Returns the low 16 bits of 'i' as a string of 16 binary digits.
+    """
+    return _byteBin[(i >> 8) & 0xFF] + _byteBin[i & 0xFF]
            
 
 def Usage():
-    print('usage: hasm sourceFile')
+    print('usage: hasm [options] sourceFile...')
+    print('    sourceFile may be a directory in which case all asm files in')
+    print('    the directory will be assembled.  Multiple files are assembled')
+    print('    in parallel.')
+    print()
+    print('    -onepass option reads the source only once, backpatching')
+    print('    forward label references.')
+    print('    -binary option writes a little-endian binary image to')
+    print('    sourceFile.bin instead of sourceFile.hack.')
+    print('    -bigendian option writes a big-endian binary image.')
+    print('    -list option writes a listing to sourceFile.lst.')
+    print('    -map option writes a symbol map to sourceFile.sym.')
+    print('    -O option removes redundant instructions before encoding.')
+    print('    Programs that jump to numeric addresses are not optimized,')
+    print('    with a warning.  Implies -onepass.')
+    print('    -cache dir option keeps encoded sources in directory dir and')
+    print('    reuses them when a source is reassembled.  Implies -onepass.')
+    print('    The cache holds encoded code, so dir must only be writable by')
+    print('    trusted users.')
+    print('    -j n option uses at most n worker processes.')
     sys.exit(-1)
 
     
+def Assemble(sourceName, outputName, onePass=False, binaryOrder=None,
+             listingName=None, mapName=None, cacheDir=None,
+             optimizing=False):
+    """
+    Assemble 'sourceName' into 'outputName'.
+    'binaryOrder' is None for a text .hack file, or LITTLE_ENDIAN or
+    BIG_ENDIAN for a binary image.
+    If 'listingName' or 'mapName' are given, a listing file and a
+    symbol map are written as well.
+    If 'cacheDir' is given, the source is assembled in one pass using
+    the cache in that directory.
+    If 'optimizing' is True, the source is assembled in one pass with
+    the peephole optimizer.
+    Returns (code size, data size).
+    """
+    return Assembler(onePass, binaryOrder, cacheDir, optimizing).Assemble(
+        sourceName, outputName, listingName, mapName)
+
+
+def OutputName(sourceName, extension):
+    """
+    Returns the name of the 'extension' file for 'sourceName'.
+    """
+    return os.path.splitext(sourceName)[0] + os.path.extsep + extension
+
+
+def CodeExtension(binaryOrder):
+    """
+    Returns the output file extension for 'binaryOrder'.
+    """
+    return 'hack' if binaryOrder == None else 'bin'
+
+
+def AssembleFile(job):
+    """
+    Worker process entry: assemble one source file.
+    'job' is (sourceName, onePass, binaryOrder, listing, symbolMap,
+    cacheDir, optimizing).
+
+    Returns (code size, data size, removed, messages) where 'removed'
+    is the number of instructions the optimizer removed and 'messages'
+    is the text the assembler printed.  The sizes are None if the
+    assembly was aborted by a fatal error.
+    """
+    (sourceName, onePass, binaryOrder, listing, symbolMap, cacheDir,
+     optimizing) = job
+    messages = io.StringIO()
+    with contextlib.redirect_stdout(messages):
+        assembler = Assembler(onePass, binaryOrder, cacheDir, optimizing)
+        try:
+            (codeSize, dataSize) = assembler.Assemble(
+                sourceName, OutputName(sourceName, CodeExtension(binaryOrder)),
+                OutputName(sourceName, 'lst') if listing else None,
+                OutputName(sourceName, 'sym') if symbolMap else None)
+        except SystemExit:
+            (codeSize, dataSize) = (None, None)
+    return (codeSize, dataSize, assembler.removed, messages.getvalue())
+
+
+def SourceFiles(names):
+    """
+    Returns the list of source files named by 'names'.  Directories
+    are replaced by the .asm files they contain, in sorted order.
+    """
+    sources = []
+    for name in names:
+        if os.path.isdir(name):
+            for fileName in sorted(os.listdir(name)):
+                if os.path.splitext(fileName)[1].lower() == os.path.extsep + 'asm':
+                    sources.append(os.path.join(name, fileName))
+        else:
+            sources.append(name)
+    return sources
+
+
 def Main():
-    global address, ramAddress, symbolTable, outFile
     try:
-        if len(sys.argv) != 2:
+        onePass = False
+        binaryOrder = None
+        jobs = None
+        listing = False
+        symbolMap = False
+        cacheDir = None
+        optimizing = False
+        while True:
+            if len(sys.argv) >= 2:
+                if sys.argv[1] == '-onepass':
+                    onePass = True
+                    del (sys.argv[1])
+                    continue
+                if sys.argv[1] == '-binary':
+                    binaryOrder = LITTLE_ENDIAN
+                    del (sys.argv[1])
+                    continue
+                if sys.argv[1] == '-bigendian':
+                    binaryOrder = BIG_ENDIAN
+                    del (sys.argv[1])
+                    continue
+                if sys.argv[1] == '-list':
+                    listing = True
+                    del (sys.argv[1])
+                    continue
+                if sys.argv[1] == '-map':
+                    symbolMap = True
+                    del (sys.argv[1])
+                    continue
+                if sys.argv[1] == '-O':
+                    optimizing = True
+                    del (sys.argv[1])
+                    continue
+                if sys.argv[1] == '-cache':
+                    if len(sys.argv) < 3:
+                        Usage()
+                    cacheDir = sys.argv[2]
+                    del (sys.argv[1:3])
+                    continue
+                if sys.argv[1] == '-j':
+                    if len(sys.argv) < 3:
+                        Usage()
+                    try:
+                        jobs = int(sys.argv[2])
+                    except ValueError:
+                        Usage()
+                    if jobs < 1:
+                        Usage()
+                    del (sys.argv[1:3])
+                    continue
+            break
+
+        if len(sys.argv) < 2:
             Usage()
             
-        sourceName = sys.argv[1]
-        outName = os.path.splitext(sourceName)[0] + os.path.extsep + 'hack'
-        try:
-            outFile = open(outName, 'w')
-        except:
-            FatalError('Could not open output file "' + outName + '"')
-            
-        symbolTable = Symbols()
-        address = 0
-        Pass1(sourceName)
+        if len(sys.argv) == 2 and not os.path.isdir(sys.argv[1]):
+            sourceName = sys.argv[1]
+            assembler = Assembler(onePass, binaryOrder, cacheDir, optimizing)
+            (address, ramAddress) = assembler.Assemble(
+                sourceName, OutputName(sourceName, CodeExtension(binaryOrder)),
+                OutputName(sourceName, 'lst') if listing else None,
+                OutputName(sourceName, 'sym') if symbolMap else None)
+            if optimizing:
+                print('Optimizer removed %d instructions' % assembler.removed)
+            print('Code size = %5d (0x%04X)' % (address, address))
+            print('Data size = %5d (0x%04X)' % (ramAddress, ramAddress))
+            return
 
-        address = 0
-        ramAddress = 0x10
-        Pass2(sourceName)
-        
-        print('Code size = %5d (0x%04X)' % (address, address))
-        print('Data size = %5d (0x%04X)' % (ramAddress, ramAddress))
+        # Results are reported in source file order.
+        sources = SourceFiles(sys.argv[1:])
+        totalCode = 0
+        totalData = 0
+        failed = 0
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = executor.map(AssembleFile, [(sourceName, onePass,
+                                                   binaryOrder, listing,
+                                                   symbolMap, cacheDir,
+                                                   optimizing)
+                                                  for sourceName in sources])
+            for (sourceName, (address, ramAddress, removed, messages)) in \
+                    zip(sources, results):
+                print('Assembling ' + sourceName)
+                sys.stdout.write(messages)
+                if address == None:
+                    failed += 1
+                    continue
+                if optimizing:
+                    print('Optimizer removed %d instructions' % removed)
+                print('Code size = %5d (0x%04X)' % (address, address))
+                print('Data size = %5d (0x%04X)' % (ramAddress, ramAddress))
+                totalCode += address
+                totalData += ramAddress
+
+        print('%d files assembled, %d failed' % (len(sources) - failed, failed))
+        print('Total code size = %7d' % totalCode)
+        print('Total data size = %7d' % totalData)
+        if failed:
+            sys.exit(-1)
 
     except SystemExit as e:
         sys.exit(e)
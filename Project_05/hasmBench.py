@@ -0,0 +1,372 @@
+#!/usr/bin/python3
+"""
+hasmBench.py -- Benchmarks for the Hack computer assembler
+
+usage: hasmBench [-n blocks] [benchmark ...]
+
+Generates a large assembly program in a temporary directory and times
+the assembler on it.  With no benchmark names all benchmarks are run.
+"""
+
+import sys
+import os
+import time
+import tempfile
+import subprocess
+import hasm
+import hasmBinary
+import hasmParser
+import hasmSymbols
+
+
+def GenerateProgram(fileName, blocks):
+    """
+    Write a synthetic program to 'fileName' that looks like VM
+    translator output: 'blocks' copies of a code block with unique
+    labels, forward and backward jumps and static variables.
+    Returns the number of source lines written.
+    """
+    lines = ['// Generated by hasmBench.py', '@256', 'D=A', '@SP', 'M=D']
+    for n in range(blocks):
+        lines.extend([
+            '(Bench.f%d)' % n,
+            '@%d' % (n % 1000),
+            'D=A',
+            '@SP',
+            'A=M',
+            'M=D',
+            '@SP',
+            'M=M+1',
+            '@SP',
+            'AM=M-1',
+            'D=M',
+            '@Bench.%d' % (n % 200),
+            'M=D',
+            '@Bench.f%d$skip' % n,
+            'D;JEQ',
+            '@Bench.f%d' % (n + 1),
+            '0;JMP',
+            '(Bench.f%d$skip)    // forward reference target' % n,
+            '@Bench.f%d' % max(n - 1, 0),
+            'D;JGT',
+            ])
+    lines.extend(['(Bench.f%d)' % blocks, '@Bench.f%d' % blocks, '0;JMP'])
+    with open(fileName, 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+    return len(lines)
+
+
+def Time(function, *args, repeat=3):
+    """
+    Returns the best wall clock time of 'repeat' calls of 'function'.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def BenchPasses(sourceName, lineCount):
+    """
+    Two-pass assembly versus -onepass assembly.
+    """
+    outTwo = os.path.splitext(sourceName)[0] + '.2.hack'
+    outOne = os.path.splitext(sourceName)[0] + '.1.hack'
+    twoPass = Time(hasm.Assemble, sourceName, outTwo, False)
+    onePass = Time(hasm.Assemble, sourceName, outOne, True)
+    with open(outTwo, 'rb') as two, open(outOne, 'rb') as one:
+        identical = two.read() == one.read()
+    print('passes: two-pass %.3fs (%d lines/s)' % (twoPass, lineCount / twoPass))
+    print('        one-pass %.3fs (%d lines/s)' % (onePass, lineCount / onePass))
+    print('        speedup %.2fx, output %s' % (twoPass / onePass,
+          'identical' if identical else 'DIFFERENT'))
+
+
+def LoopInt2Bin(i):
+    # The original bit-by-bit Int2Bin(), kept as the reference.
+    bin = ''
+    while i:
+        if i & 1:
+            bin = '1' + bin
+        else:
+            bin = '0' + bin
+        i //= 2
+    bin = '0' * 16 + bin
+    return bin[-16:]
+
+
+def BenchInt2Bin(sourceName, lineCount):
+    """
+    Table driven hasm.Int2Bin() versus the original loop on a
+    million-word program.
+    """
+    for i in range(0x10000):
+        if hasm.Int2Bin(i) != LoopInt2Bin(i):
+            print('int2bin: DIFFERENT output for %d' % i)
+            return
+    words = [(i * 40503) & 0xFFFF for i in range(1000000)]
+    loop = Time(lambda: [LoopInt2Bin(word) for word in words])
+    table = Time(lambda: [hasm.Int2Bin(word) for word in words])
+    print('int2bin: loop  %.3fs (%d words/s)' % (loop, len(words) / loop))
+    print('         table %.3fs (%d words/s)' % (table, len(words) / table))
+    print('         speedup %.2fx, output identical' % (loop / table))
+
+
+def LoadText(fileName):
+    with open(fileName) as file:
+        return [int(line, 2) for line in file]
+
+
+def BenchLoad(sourceName, lineCount):
+    """
+    Loading a text .hack file versus mapping a binary image.
+    """
+    textName = os.path.splitext(sourceName)[0] + '.hack'
+    binaryName = os.path.splitext(sourceName)[0] + '.bin'
+    hasm.Assemble(sourceName, textName, True)
+    hasm.Assemble(sourceName, binaryName, True, hasmBinary.LITTLE_ENDIAN)
+    identical = LoadText(textName) == list(hasmBinary.LoadBinary(binaryName)[0])
+    text = Time(LoadText, textName)
+    binary = Time(hasmBinary.LoadBinary, binaryName)
+    print('load: text   %.6fs (%d bytes)' % (text, os.path.getsize(textName)))
+    print('      binary %.6fs (%d bytes)' % (binary, os.path.getsize(binaryName)))
+    print('      speedup %.0fx, code %s' % (text / binary,
+          'identical' if identical else 'DIFFERENT'))
+
+
+def ParseLines(parser):
+    # Drive a parser through its Parser interface.
+    while parser.HasMoreCommands():
+        parser.Advance()
+        commandType = parser.CommandType()
+        if commandType in (hasmParser.A_COMMAND, hasmParser.L_COMMAND):
+            parser.Symbol()
+        elif commandType == hasmParser.C_COMMAND:
+            parser.Dest()
+            parser.Comp()
+            parser.Jump()
+
+
+def BenchParser(sourceName, lineCount):
+    """
+    Parser versus BufferParser, through the Parser interface and
+    through BufferParser.Records().
+    """
+    lines = Time(lambda: ParseLines(hasmParser.Parser(sourceName)))
+    facade = Time(lambda: ParseLines(hasmParser.BufferParser(sourceName)))
+    records = Time(lambda: hasmParser.BufferParser(sourceName).Records())
+    print('parser: Parser                %.3fs (%d lines/s)' %
+          (lines, lineCount / lines))
+    print('        BufferParser facade   %.3fs (%d lines/s)' %
+          (facade, lineCount / facade))
+    print('        BufferParser records  %.3fs (%d lines/s)' %
+          (records, lineCount / records))
+
+
+def BenchCache(sourceName, lineCount):
+    """
+    -onepass without a cache versus unchanged and slightly changed
+    sources with a warm cache.
+    """
+    dirName = os.path.dirname(sourceName)
+    cacheDir = os.path.join(dirName, 'cache')
+    outName = os.path.join(dirName, 'Cache.hack')
+    changedName = os.path.join(dirName, 'Changed.asm')
+    with open(sourceName) as file:
+        source = file.read()
+
+    def Changed():
+        # Assemble a new version of the source with one line changed.
+        Changed.version += 1
+        with open(changedName, 'w') as file:
+            file.write(source.replace('@Bench.17\n',
+                                      '@%d\n' % Changed.version, 1))
+        hasm.Assemble(changedName, outName, True, cacheDir=cacheDir)
+    Changed.version = 0
+
+    cold = Time(hasm.Assemble, sourceName, outName, True)
+    hasm.Assemble(sourceName, outName, True, cacheDir=cacheDir)
+    warm = Time(hasm.Assemble, sourceName, outName, True, None, None, None,
+                cacheDir)
+    Changed()
+    partial = Time(Changed)
+    print('cache: no cache  %.3fs' % cold)
+    print('       unchanged %.3fs (%.2fx)' % (warm, cold / warm))
+    print('       changed   %.3fs (%.2fx)' % (partial, cold / partial))
+
+
+def BenchLibrary(sourceName, lineCount):
+    """
+    Assembly latency in-process, through the Assembler class, versus
+    running hasm.py as a subprocess, for a small and a large source.
+    """
+    dirName = os.path.dirname(sourceName)
+    smallName = os.path.join(dirName, 'Small.asm')
+    GenerateProgram(smallName, 10)
+    script = os.path.join(os.path.dirname(os.path.abspath(hasm.__file__)),
+                          'hasm.py')
+    assembler = hasm.Assembler(True)
+
+    def Process(fileName):
+        subprocess.run([sys.executable, script, '-onepass', fileName],
+                       stdout=subprocess.DEVNULL, check=True)
+
+    def Stream(fileName):
+        with open(fileName) as file:
+            for word in assembler.Words(file):
+                pass
+
+    for (name, fileName) in (('small', smallName), ('large', sourceName)):
+        outName = os.path.splitext(fileName)[0] + '.lib.hack'
+        process = Time(Process, fileName)
+        library = Time(assembler.Assemble, fileName, outName)
+        stream = Time(Stream, fileName)
+        with open(outName) as lib, \
+                open(os.path.splitext(fileName)[0] + '.hack') as out:
+            identical = lib.read() == out.read()
+        print('library: %s subprocess %.4fs' % (name, process))
+        print('         %s Assemble() %.4fs (%.1fx)' %
+              (name, library, process / library))
+        print('         %s Words()    %.4fs (%.1fx), output %s' %
+              (name, stream, process / stream,
+               'identical' if identical else 'DIFFERENT'))
+
+
+class LoopSymbols(hasmSymbols.Symbols):
+    # The original symbol table, kept as the reference: names are
+    # checked character by character on every AddEntry().
+
+    def _ValidName(self, symbol):
+        if len(symbol) == 0:
+            return False
+        valid = self.initialChars
+        for c in symbol:
+            if not c in valid:
+                return False
+            valid = self.continueChars
+        return True
+
+
+def ResolveLoop(labels, refs):
+    # Resolve the way the original Pass1() and Pass2() did.
+    table = LoopSymbols()
+    for (symbol, address) in labels:
+        table.AddEntry(symbol, address)
+    ramAddress = 0x10
+    values = []
+    for symbol in refs:
+        if table.Contains(symbol):
+            values.append(table.GetAddress(symbol))
+        elif table.AddEntry(symbol, ramAddress):
+            values.append(ramAddress)
+            ramAddress += 1
+    return values
+
+
+def Resolve(labels, refs, table=None):
+    # Resolve with a single LookupOrAdd() per reference.
+    if table is None:
+        table = hasmSymbols.Symbols()
+        for (symbol, address) in labels:
+            table.AddEntry(symbol, address)
+    ramAddress = 0x10
+    values = []
+    for symbol in refs:
+        (value, added) = table.LookupOrAdd(symbol, ramAddress)
+        if added:
+            ramAddress += 1
+        values.append(value)
+    return values
+
+
+def BenchSymbols(sourceName, lineCount):
+    """
+    The original symbol table versus interned names with cached
+    validity and LookupOrAdd(), and versus starting from a snapshot
+    saved by an earlier build.
+    """
+    labels = []
+    refs = []
+    address = 0
+    for record in hasmParser.BufferParser(sourceName).Records():
+        if record[hasmParser.R_TYPE] == hasmParser.L_COMMAND:
+            labels.append((record[hasmParser.R_SYMBOL], address))
+            continue
+        if record[hasmParser.R_TYPE] == hasmParser.A_COMMAND:
+            if not record[hasmParser.R_SYMBOL].isdigit():
+                refs.append(record[hasmParser.R_SYMBOL])
+        address += 1
+
+    table = hasmSymbols.Symbols()
+    for (symbol, address) in labels:
+        table.AddEntry(symbol, address)
+    Resolve(labels, refs, table)
+    snapshotName = os.path.splitext(sourceName)[0] + '.symbols'
+    table.Save(snapshotName)
+
+    def Restored():
+        restored = hasmSymbols.Symbols()
+        restored.Load(snapshotName)
+        return Resolve(labels, refs, restored)
+
+    identical = ResolveLoop(labels, refs) == Resolve(labels, refs) == \
+        Restored()
+    loop = Time(ResolveLoop, labels, refs)
+    lookup = Time(Resolve, labels, refs)
+    restored = Time(Restored)
+    print('symbols: %d labels, %d references' % (len(labels), len(refs)))
+    print('         original      %.3fs' % loop)
+    print('         LookupOrAdd   %.3fs (%.2fx)' % (lookup, loop / lookup))
+    print('         from snapshot %.3fs (%.2fx), addresses %s' %
+          (restored, loop / restored,
+           'identical' if identical else 'DIFFERENT'))
+
+
+benchmarks = {
+    'passes': BenchPasses,
+    'int2bin': BenchInt2Bin,
+    'load': BenchLoad,
+    'parser': BenchParser,
+    'cache': BenchCache,
+    'library': BenchLibrary,
+    'symbols': BenchSymbols,
+    }
+
+
+def Usage():
+    print('usage: hasmBench [-n blocks] [benchmark ...]')
+    print('    benchmarks: ' + ' '.join(benchmarks))
+    sys.exit(-1)
+
+
+def Main():
+    blocks = 20000
+    while True:
+        if len(sys.argv) >= 3 and sys.argv[1] == '-n':
+            try:
+                blocks = int(sys.argv[2])
+            except ValueError:
+                Usage()
+            del (sys.argv[1:3])
+            continue
+        break
+
+    names = sys.argv[1:] or list(benchmarks)
+    for name in names:
+        if name not in benchmarks:
+            Usage()
+
+    with tempfile.TemporaryDirectory() as dirName:
+        sourceName = os.path.join(dirName, 'Bench.asm')
+        lineCount = GenerateProgram(sourceName, blocks)
+        print('%d source lines' % lineCount)
+        for name in names:
+            benchmarks[name](sourceName, lineCount)
+
+
+if __name__ == '__main__':
+    Main()
@@ -0,0 +1,86 @@
+"""
+hasmBinary.py -- Binary ROM image files for Hack computer assembler
+
+A binary image is a 16 byte header followed by the code as unsigned
+16-bit words.  The header is always little-endian:
+
+    4 bytes  magic 'HACK'
+    1 byte   format version (1)
+    1 byte   byte order of the code words, 0 little-endian, 1 big-endian
+    2 bytes  reserved (0)
+    4 bytes  code size in words
+    4 bytes  data size in words
+
+The 16 byte header keeps the code words aligned so that LoadBinary()
+can map them straight from the file.
+"""
+
+import sys
+import mmap
+import struct
+from array import array
+from hasmError import *
+
+
+LITTLE_ENDIAN = 0
+BIG_ENDIAN = 1
+
+_magic = b'HACK'
+_version = 1
+_header = struct.Struct('<4sBBHII')
+_nativeOrder = BIG_ENDIAN if sys.byteorder == 'big' else LITTLE_ENDIAN
+
+
+def WriteBinary(fileName, code, dataSize, byteOrder=LITTLE_ENDIAN):
+    """
+    Write the list of integer instruction codes 'code' to binary image
+    'fileName'.  'dataSize' is recorded in the header.
+    """
+    words = array('H', code)
+    if byteOrder != _nativeOrder:
+        words.byteswap()
+    try:
+        file = open(fileName, 'wb')
+    except:
+        FatalError('Could not open output file "' + fileName + '"')
+    with file:
+        file.write(_header.pack(_magic, _version, byteOrder, 0,
+                                len(words), dataSize))
+        words.tofile(file)
+
+
+def LoadBinary(fileName):
+    """
+    Load binary image 'fileName'.
+    Returns (code, dataSize).
+
+    If the image's byte order is the machine's, 'code' is a read-only
+    memoryview of unsigned 16-bit words mapped directly from the file;
+    nothing is copied.  Otherwise 'code' is a byte swapped array('H').
+    """
+    try:
+        file = open(fileName, 'rb')
+    except:
+        FatalError('Could not open binary file "' + fileName + '"')
+    with file:
+        header = file.read(_header.size)
+        if len(header) != _header.size:
+            FatalError('Truncated binary file "' + fileName + '"')
+        (magic, version, byteOrder, _, codeSize, dataSize) = \
+            _header.unpack(header)
+        if magic != _magic or version != _version:
+            FatalError('"' + fileName + '" is not a Hack binary file')
+        end = _header.size + 2 * codeSize
+        if byteOrder == _nativeOrder and codeSize > 0:
+            image = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            if len(image) < end:
+                FatalError('Truncated binary file "' + fileName + '"')
+            return (memoryview(image)[_header.size:end].cast('H'), dataSize)
+        code = array('H')
+        try:
+            code.fromfile(file, codeSize)
+        except EOFError:
+            FatalError('Truncated binary file "' + fileName + '"')
+        if byteOrder != _nativeOrder:
+            code.byteswap()
+        return (code, dataSize)
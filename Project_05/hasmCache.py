@@ -0,0 +1,134 @@
+"""
+hasmCache.py -- On-disk cache for Hack computer assembler
+
+The cache is a directory of pickle files, one per entry, named by the
+entry's key.  It is bounded by entry count and total size; when a new
+entry pushes it over either bound, the least recently used entries are
+deleted.  Load() touches an entry's modification time, so the file
+times give the LRU order.
+
+An entry is read with an unpickler that refuses every class and
+function, so it can only hold plain data (lists, tuples, dicts,
+strings, numbers) and reading a cache file never runs code from it.
+Each entry also holds its key, and one that does not match the file's
+name is a miss.  Entries are trusted to hold correct code, so the
+directory should not be writable by anyone you would not let edit the
+assembler's output.
+
+Several assemblers may share a cache directory.  Entries are written to
+a temporary file and renamed into place, so readers never see a
+partial entry, and an entry that disappears or cannot be read is just
+a cache miss.
+"""
+
+import os
+import pickle
+import hashlib
+import tempfile
+
+
+class _DataUnpickler(pickle.Unpickler):
+    # Refuses all globals, so that loading cannot call anything.
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError('%s.%s is not allowed in the cache' %
+                                     (module, name))
+
+
+def Key(data):
+    """
+    Returns the cache key for 'data', a str or bytes.
+    """
+    if isinstance(data, str):
+        data = data.encode()
+    return hashlib.sha1(data).hexdigest()
+
+
+class Cache(object):
+    _suffix = '.pickle'
+
+    def __init__(self, dirName, maxEntries=256, maxBytes=256*1024*1024):
+        """
+        Constructor Cache(dirName, maxEntries, maxBytes)
+        Use directory 'dirName' for the cache, creating it if needed.
+        """
+        self.dirName = dirName
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        os.makedirs(dirName, exist_ok=True)
+
+
+    def Load(self, key):
+        """
+        Returns the value stored for 'key', or None if there is none.
+        """
+        path = self._Path(key)
+        try:
+            with open(path, 'rb') as file:
+                (entryKey, value) = _DataUnpickler(file).load()
+            if entryKey != key:
+                return None
+            os.utime(path)
+        except Exception:
+            return None
+        return value
+
+
+    def Store(self, key, value):
+        """
+        Store 'value' for 'key', then evict entries if the cache has
+        grown past its bounds.
+        """
+        # The cache is only an optimization; failing to write an entry
+        # is not an error.
+        try:
+            (fd, tempName) = tempfile.mkstemp(dir=self.dirName,
+                                              suffix='.tmp')
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                pickle.dump((key, value), file, pickle.HIGHEST_PROTOCOL)
+            os.replace(tempName, self._Path(key))
+        except OSError:
+            try:
+                os.remove(tempName)
+            except OSError:
+                pass
+            return
+        self._Evict()
+
+
+    def _Path(self, key):
+        return os.path.join(self.dirName, key + self._suffix)
+
+
+    def _Evict(self):
+        # Delete least recently used entries until the cache is within
+        # its bounds.  Entries deleted meanwhile by another process are
+        # skipped.
+        entries = []
+        totalBytes = 0
+        try:
+            names = os.listdir(self.dirName)
+        except OSError:
+            return
+        for name in names:
+            if not name.endswith(self._suffix):
+                continue
+            try:
+                status = os.stat(os.path.join(self.dirName, name))
+            except OSError:
+                continue
+            entries.append((status.st_mtime, status.st_size, name))
+            totalBytes += status.st_size
+        entries.sort()
+        count = len(entries)
+        for (_, size, name) in entries:
+            if count <= self.maxEntries and totalBytes <= self.maxBytes:
+                break
+            try:
+                os.remove(os.path.join(self.dirName, name))
+            except OSError:
+                pass
+            count -= 1
+            totalBytes -= size
@@ -63,12 +63,26 @@ class Code(object):
             'AMD': '111'
             }
     
+    # Opcode of every legal (dest, comp, jump) mnemonic triple.
+    # Built once by _BuildCommandDict() below.
+    _commandDict = {}
+
     def __init__(self):
         """
         Constructor Code()
         """
         pass    
 
+    def Command(self, dest, comp, jump):
+        """
+        Returns the 16-bit integer code of the C-command dest=comp;jump.
+        dest and jump may be empty strings.
+
+        Returns None if any of the mnemonics cannot be decoded.  Use
+        Dest(), Comp() and Jump() to find out which one.
+        """
+        return self._commandDict.get((dest, comp, jump))
+
     def Dest(self, mnemonic):
         if len(mnemonic) == 0:
             return '000'
@@ -99,3 +113,23 @@ class Code(object):
             return self._jumpDict[mnemonic]
         else:
             return None
+
+
+def _BuildCommandDict():
+    # Precompute the integer opcodes for every dest/comp/jump combination,
+    # including the commutative comp aliases, so that encoding a C-command
+    # is a single dictionary lookup.
+    dests = dict(Code._destDict)
+    dests[''] = '000'
+    jumps = dict(Code._jumpDict)
+    jumps[''] = '000'
+    commands = {}
+    for (comp, compBits) in Code._compDict.items():
+        compCode = 0xE000 | (int(compBits, 2) << 6)
+        for (dest, destBits) in dests.items():
+            destCode = compCode | (int(destBits, 2) << 3)
+            for (jump, jumpBits) in jumps.items():
+                commands[(dest, comp, jump)] = destCode | int(jumpBits, 2)
+    return commands
+
+Code._commandDict = _BuildCommandDict()
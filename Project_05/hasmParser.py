@@ -14,8 +14,13 @@ NO_COMMAND for any lines that contains no command.
 Use LineNo() to retrieve the current input line number and Line()
 to retrieve the text.  These can be used to add context to error
 messages.
+
+BufferParser reads the whole source at once and tokenizes it with a
+single compiled regular expression.  Records() returns the commands
+as compact tuples; the Parser methods are provided on top of them.
 """
 
+import re
 from hasmError import *
 
 
@@ -200,3 +205,181 @@ class Parser(object):
         else:
             self.jump = self.line[i+1:].strip()
         
+
+
+# Field indexes of the records returned by BufferParser.Records().
+R_TYPE = 0
+R_SYMBOL = 1
+R_DEST = 2
+R_COMP = 3
+R_JUMP = 4
+R_LINENO = 5
+
+
+class BufferParser(Parser):
+    # Matches one source line, including its newline.  Well formed
+    # commands are decoded by the named groups; anything left over in
+    # group 'x' sends the line to Parser's line-at-a-time code so that
+    # odd input is handled exactly as Parser handles it.
+    _lineRe = re.compile(r"""
+        [ \t]*
+        (?:
+            @[ \t]*(?P<a>[^\s/]+)
+          | \([ \t]*(?P<l>[^\s/()]+)[ \t]*\)
+          | (?:(?P<d>[AMD]+)=)?(?P<c>[-+!&|01ADM]+)(?:;(?P<j>J[A-Z]+))?
+        )?
+        [ \t]*(?://[^\n]*)?
+        (?P<x>[^\n]*)\n
+        """, re.X)
+
+    # Matches the start of a line holding a label.
+    _labelRe = re.compile(r'^[ \t]*\(', re.M)
+
+    def __init__(self, source: str, text=None):
+        """
+        Constructor BufferParser(source, text)
+        Read all of 'source'.  It is tokenized when Records() is first
+        called.
+        If 'text' is given, it is the source text and 'source' is only
+        used as its name.
+        """
+        if text is not None:
+            self.buffer = text
+        else:
+            try:
+                with open(source, 'r') as file:
+                    self.buffer = file.read()
+            except:
+                FatalError('Could not open source file "'+source+'"')
+        if not self.buffer.endswith('\n'):
+            self.buffer += '\n'
+
+        self.lines = None
+        self.records = None
+        self.next = 0
+        self.file = True
+        self.lineNumber: int = 0
+        self.rawline: str = ''
+        self.line: str = ''
+        self.commandType = NO_COMMAND
+
+
+    def Records(self):
+        """
+        Returns the list of commands in the source.  Each command is a
+        tuple (commandType, symbol, dest, comp, jump, lineNumber), see
+        the R_xxx field indexes.  Fields that do not apply to the
+        command type are None.  Lines with no command are omitted.
+        """
+        if self.records is None:
+            self.records = self.Tokenize(0, len(self.buffer), 1)
+        return self.records
+
+
+    def Regions(self):
+        """
+        Splits the source into regions that each start at a label line.
+        The first region starts at the beginning of the source.
+        Returns a list of (start, end, lineNumber) where 'start' and
+        'end' are buffer offsets and 'lineNumber' is the line number
+        of the first line in the region.
+        """
+        buffer = self.buffer
+        regions = []
+        start = 0
+        lineNumber = 1
+        for match in self._labelRe.finditer(buffer):
+            end = match.start()
+            if end > start:
+                regions.append((start, end, lineNumber))
+                lineNumber += buffer.count('\n', start, end)
+                start = end
+        regions.append((start, len(buffer), lineNumber))
+        return regions
+
+
+    def SourceLine(self, lineNumber):
+        """
+        Returns the text of input line 'lineNumber'.
+        May be used to add context to error messages.
+        """
+        if self.lines is None:
+            self.lines = self.buffer.split('\n')
+        return self.lines[lineNumber-1].rstrip()
+
+
+    def Advance(self):
+        """
+        Makes the next command the current command.
+        Returns True if there was a command, None at end of file.
+        Lines with no command are skipped.
+        """
+        records = self.Records()
+        if self.next >= len(records):
+            self.file = None
+            self.commandType = NO_COMMAND
+            return
+        (self.commandType, self.symbol, self.dest, self.comp, self.jump,
+         self.lineNumber) = records[self.next]
+        self.next += 1
+        return True
+
+
+    def Line(self):
+        """
+        Returns the input line that has been parsed.
+        """
+        return self.SourceLine(self.lineNumber)
+
+
+    def Tokenize(self, start, end, lineNumber):
+        """
+        Returns the records, as Records() does, for the part of the
+        buffer from offset 'start' to 'end'.  'start' must be at the
+        beginning of line 'lineNumber' and 'end' just after a newline.
+        """
+        return list(self._Records(self._lineRe.finditer(self.buffer, start,
+                                                        end),
+                                  lineNumber))
+
+
+    def StreamRecords(self, lines):
+        """
+        Generator of records, as Records() returns, for the iterable of
+        source lines 'lines'.  Each line is tokenized as it is read; the
+        parser's own buffer is not used.
+        """
+        match = self._lineRe.match
+        return self._Records((match(line.rstrip('\r\n') + '\n')
+                              for line in lines), 1)
+
+
+    def _Records(self, matches, lineNumber):
+        # Generate the records for an iterable of _lineRe matches, one
+        # per source line starting at line 'lineNumber'.
+        lineNumber -= 1
+        for match in matches:
+            lineNumber += 1
+            (a, l, d, c, j, x) = match.groups()
+            if x:
+                self._ParseLine(match.group(0))
+                if self.commandType != NO_COMMAND:
+                    yield (self.commandType, self.symbol, self.dest,
+                           self.comp, self.jump, lineNumber)
+            elif c is not None:
+                yield (C_COMMAND, None, d or '', c, j or '', lineNumber)
+            elif a is not None:
+                yield (A_COMMAND, a, None, None, None, lineNumber)
+            elif l is not None:
+                yield (L_COMMAND, l, None, None, None, lineNumber)
+
+
+    def _ParseLine(self, rawline):
+        # Parse a line the way Parser.Advance() does.
+        self.line = rawline.rstrip()
+        i = self.line.find('//')
+        if i != -1:
+            self.line = self.line[:i]
+        self.line = self.line.strip()
+        self.line = self.line.replace('\t', ' ')
+        self._Parse()
@@ -0,0 +1,167 @@
+"""
+hasmPeephole.py -- Peephole optimizer for Hack computer assembler
+
+Optimize() rewrites a list of BufferParser records before they are
+encoded.  It removes:
+
+    A-commands whose value is overwritten before it is used
+        @X, @Y             ->  @Y
+        @X, A=D            ->  A=D
+    A-commands that load the value A already holds
+        @SP, M=M-1, @SP    ->  @SP, M=M-1
+    increments and decrements of the same memory word that cancel
+        M=M+1, M=M-1       ->  (nothing)
+    jumps to the label that follows them
+        @L, 0;JMP, (L), @X ->  (L), @X
+    unreachable commands after an unconditional jump, up to the next
+    label
+
+Labels are the only places control can arrive from elsewhere, so
+nothing is assumed about the registers across a label and no rule
+looks across one, except for the jump rule which checks that the
+command after the label does not use A.
+
+Removing commands moves code to new addresses, which labels follow
+but numbers do not.  A program with a jump whose target is loaded by
+an A-command that is not a label, like @6 or @SP, is not optimized;
+Optimize() reports the first such jump and returns it unchanged.
+Targets computed into A, like return addresses loaded with A=M, are
+assumed to come from labels.
+"""
+
+from hasmParser import *
+from hasmSymbols import *
+from hasmError import *
+
+
+_builtIn = Symbols().symbolDict
+
+
+def Optimize(records):
+    """
+    Returns (records, saved): the optimized copy of the list 'records'
+    and the number of commands removed.
+    """
+    count = len(records)
+    unsafe = _NumericJump(records)
+    if unsafe != None:
+        Error('Jump to %s, which is not a label: not optimizing' %
+              unsafe[R_SYMBOL], unsafe[R_LINENO])
+        return (records, 0)
+    while True:
+        optimized = _JumpsToNext(_Straight(records))
+        if len(optimized) == len(records):
+            break
+        records = optimized
+    return (records, count - len(records))
+
+
+def _NumericJump(records):
+    # Returns the first A-command that loads a jump target other than
+    # a label, or None.
+    labels = set([record[R_SYMBOL] for record in records
+                  if record[R_TYPE] == L_COMMAND])
+    target = None       # The A-command A was last loaded by.
+    for record in records:
+        commandType = record[R_TYPE]
+        if commandType == A_COMMAND:
+            target = record
+        elif commandType == L_COMMAND:
+            target = None
+        elif commandType == C_COMMAND:
+            if (record[R_JUMP] != '' and target != None
+                    and target[R_SYMBOL] not in labels):
+                return target
+            if 'A' in record[R_DEST]:
+                target = None
+    return None
+
+
+def _AValue(symbol):
+    # Returns a key identifying the value @symbol loads into A.
+    # Numbers and built-in symbols are keyed by value.
+    try:
+        return int(symbol) & 0x7FFF
+    except ValueError:
+        return _builtIn.get(symbol, symbol)
+
+
+def _IsA(record):
+    return record[R_TYPE] == A_COMMAND
+
+
+def _Straight(records):
+    # Apply the rules that work on straight line code.
+    out = []
+    knownA = None       # What A holds, if known.
+    reachable = True
+    for record in records:
+        commandType = record[R_TYPE]
+
+        if commandType == L_COMMAND:
+            out.append(record)
+            knownA = None
+            reachable = True
+            continue
+
+        if not reachable:
+            continue
+
+        if commandType == A_COMMAND:
+            value = _AValue(record[R_SYMBOL])
+            if value == knownA:
+                continue
+            if out and _IsA(out[-1]):
+                out.pop()
+            out.append(record)
+            knownA = value
+            continue
+
+        if commandType != C_COMMAND:
+            out.append(record)
+            continue
+
+        dest = record[R_DEST]
+        comp = record[R_COMP]
+        jump = record[R_JUMP]
+        if out and jump == '' and dest == 'M' and comp in ('M+1', 'M-1'):
+            previous = out[-1]
+            if (previous[R_TYPE] == C_COMMAND and previous[R_DEST] == 'M'
+                    and previous[R_JUMP] == ''
+                    and {previous[R_COMP], comp} == {'M+1', 'M-1'}):
+                out.pop()
+                continue
+        if (out and _IsA(out[-1]) and jump == '' and 'A' in dest
+                and 'M' not in dest and 'A' not in comp and 'M' not in comp):
+            out.pop()
+        out.append(record)
+        if 'A' in dest:
+            knownA = None
+        if jump == 'JMP':
+            reachable = False
+    return out
+
+
+def _JumpsToNext(records):
+    # Remove @L, <comp>;<jump> when (L) follows it and the command
+    # after the labels does not depend on A.
+    out = []
+    i = 0
+    n = len(records)
+    while i < n:
+        record = records[i]
+        if (_IsA(record) and i + 1 < n
+                and records[i+1][R_TYPE] == C_COMMAND
+                and records[i+1][R_DEST] == ''
+                and records[i+1][R_JUMP] != ''):
+            j = i + 2
+            labels = set()
+            while j < n and records[j][R_TYPE] == L_COMMAND:
+                labels.add(records[j][R_SYMBOL])
+                j += 1
+            if record[R_SYMBOL] in labels and (j == n or _IsA(records[j])):
+                i += 2
+                continue
+        out.append(record)
+        i += 1
+    return out
@@ -5,6 +5,8 @@ hasmSymbols.py -- Symbol table for Hack computer assembler
 See "The Elements of Computing Systems", by Noam Nisan and Shimon Schocken
 """
 
+import re
+import sys
 from hasmError import *
 
 
@@ -12,37 +14,49 @@ class Symbols(object):
     # Valid characters for symbol names.
     initialChars = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMONPQRSTUVWXYZ_.$:'
     continueChars = initialChars + '0123456789'
+    _nameRe = re.compile('[' + re.escape(initialChars) + ']['
+                         + re.escape(continueChars) + r']*\Z')
+
+    # Validity of the names seen so far, shared by all symbol tables.
+    _validNames = {}
+    _maxValidNames = 1 << 16
+
+    builtIn = {
+        'SP': 0,
+        'LCL': 1,
+        'ARG': 2,
+        'THIS': 3,
+        'THAT': 4,
+        'R0': 0,
+        'R1': 1,
+        'R2': 2,
+        'R3': 3,
+        'R4': 4,
+        'R5': 5,
+        'R6': 6,
+        'R7': 7,
+        'R8': 8,
+        'R9': 9,
+        'R10': 10,
+        'R11': 11,
+        'R12': 12,
+        'R13': 13,
+        'R14': 14,
+        'R15': 15,
+        'SCREEN': 0x4000,
+        'KBD': 0x6000
+        }
     
-    def __init__(self):
-        """
-        Constructor Symbols()
-        Initializes the symbol table with built-in symbols.
-        """
-        self.symbolDict = {
-            'SP': 0,
-            'LCL': 1,
-            'ARG': 2,
-            'THIS': 3,
-            'THAT': 4,
-            'R0': 0,
-            'R1': 1,
-            'R2': 2,
-            'R3': 3,
-            'R4': 4,
-            'R5': 5,
-            'R6': 6,
-            'R7': 7,
-            'R8': 8,
-            'R9': 9,
-            'R10': 10,
-            'R11': 11,
-            'R12': 12,
-            'R13': 13,
-            'R14': 14,
-            'R15': 15,
-            'SCREEN': 0x4000,
-            'KBD': 0x6000
-            }
+    def __init__(self, snapshot=None):
+        """
+        Constructor Symbols(snapshot)
+        Initializes the symbol table with built-in symbols, or with the
+        symbols of 'snapshot' if it is given.  See Snapshot().
+        """
+        if snapshot != None:
+            self.symbolDict = dict(snapshot)
+        else:
+            self.symbolDict = dict(self.builtIn)
 
     def Contains(self, symbol):
         """
@@ -56,6 +70,12 @@ class Symbols(object):
         Raises exception if symbol not found.
         """
         return self.symbolDict[symbol]
+
+    def Lookup(self, symbol):
+        """
+        Returns 'symbol's address, or None if symbol not found.
+        """
+        return self.symbolDict.get(symbol)
             
     def AddEntry(self, symbol, value):
         """
@@ -67,19 +87,80 @@ class Symbols(object):
         Existing entries will be silently overwritten.
         """
         if self._ValidName(symbol):
-            self.symbolDict[symbol] = value
+            self.symbolDict[sys.intern(symbol)] = value
             return True
         else:
             return False
 
+    def LookupOrAdd(self, symbol, value):
+        """
+        Look up 'symbol', adding it with 'value' if it is not in the
+        symbol table.
+
+        Returns (address, added).  'address' is None if the symbol was
+        not found and its name is illegal.
+        """
+        address = self.symbolDict.get(symbol)
+        if address != None:
+            return (address, False)
+        if self._ValidName(symbol):
+            self.symbolDict[sys.intern(symbol)] = value
+            return (value, True)
+        return (None, False)
+
+    def Snapshot(self):
+        """
+        Returns a copy of the symbol table's contents, which can be
+        given to Symbols() or Restore().
+        """
+        return dict(self.symbolDict)
+
+    def Restore(self, snapshot):
+        """
+        Replace the symbol table's contents with 'snapshot'.
+        """
+        self.symbolDict = {sys.intern(symbol): value
+                           for (symbol, value) in snapshot.items()}
+
+    def Save(self, fileName):
+        """
+        Write a snapshot of the symbol table to 'fileName', one
+        "symbol address" line per entry.
+        """
+        try:
+            file = open(fileName, 'w')
+        except:
+            FatalError('Could not open symbol file "' + fileName + '"')
+        with file:
+            for (symbol, value) in self.symbolDict.items():
+                file.write('%s %d\n' % (symbol, value))
+
+    def Load(self, fileName):
+        """
+        Replace the symbol table's contents with the snapshot saved in
+        'fileName' by Save().
+        """
+        snapshot = {}
+        try:
+            with open(fileName, 'r') as file:
+                for line in file:
+                    (symbol, value) = line.split()
+                    value = int(value)
+                    if not self._ValidName(symbol) or value < 0:
+                        raise ValueError
+                    snapshot[symbol] = value
+        except:
+            FatalError('Could not read symbol file "' + fileName + '"')
+        self.Restore(snapshot)
+
 
     def _ValidName(self, symbol):
-        # Returns True if 'symbol' is a valid symbol name.
-        if len(symbol) == 0:
-            return False
-        valid = self.initialChars
-        for c in symbol:
-            if not c in valid:
-                return False
-            valid = self.continueChars
-        return True
+        # Returns True if 'symbol' is a valid symbol name.  Results are
+        # cached; VM translator output refers to each label many times.
+        valid = self._validNames.get(symbol)
+        if valid == None:
+            if len(self._validNames) >= self._maxValidNames:
+                self._validNames.clear()
+            valid = self._nameRe.match(symbol) != None
+            self._validNames[sys.intern(symbol)] = valid
+        return valid
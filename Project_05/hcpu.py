@@ -0,0 +1,546 @@
+#!/usr/bin/python3
+"""
+hcpu.py -- Hack computer CPU emulator
+
+See "The Elements of Computing Systems", by Noam Nisan and Shimon Schocken
+
+Cpu loads a program from a .hack text file, a binary image written by
+hasm.py -binary or an .asm source, which is assembled in-process.
+Each ROM word is decoded once when it is loaded: A-commands become
+their integer value and C-commands a tuple of the ALU function and
+the destination and jump fields, so Run() does no bit twiddling.
+
+Cpu(compiled=True) runs the program as basic blocks compiled to Python
+functions, see hcpuBlocks.py.
+
+Script runs a subset of the CPUEmulator test script language:
+load, output-file, compare-to, output-list, set, repeat, ticktock,
+output, echo and clear-echo.  It runs VMEmulator scripts, with vmstep,
+on any machine whose stepCommand is 'vmstep', see
+Project07/hvmEmulator.py.
+"""
+
+import sys
+import os
+import re
+import time
+from array import array
+from hasmBinary import *
+from hcpuBlocks import *
+from hasmError import *
+
+
+ROM_SIZE = 0x8000
+RAM_SIZE = 0x6001           # Up to and including the keyboard.
+
+# Jump field bits, and the bit each kind of ALU output tests.
+_JLT = 4
+_JEQ = 2
+_JGT = 1
+
+# ALU functions of the documented comp fields, by the 6 c-bits.
+# The second argument is A or M.
+_aluDict = {
+    0b101010: lambda d, y: 0,
+    0b111111: lambda d, y: 1,
+    0b111010: lambda d, y: 0xFFFF,
+    0b001100: lambda d, y: d,
+    0b110000: lambda d, y: y,
+    0b001101: lambda d, y: d ^ 0xFFFF,
+    0b110001: lambda d, y: y ^ 0xFFFF,
+    0b001111: lambda d, y: -d & 0xFFFF,
+    0b110011: lambda d, y: -y & 0xFFFF,
+    0b011111: lambda d, y: (d + 1) & 0xFFFF,
+    0b110111: lambda d, y: (y + 1) & 0xFFFF,
+    0b001110: lambda d, y: (d - 1) & 0xFFFF,
+    0b110010: lambda d, y: (y - 1) & 0xFFFF,
+    0b000010: lambda d, y: (d + y) & 0xFFFF,
+    0b010011: lambda d, y: (d - y) & 0xFFFF,
+    0b000111: lambda d, y: (y - d) & 0xFFFF,
+    0b000000: lambda d, y: d & y,
+    0b010101: lambda d, y: d | y,
+    }
+
+
+def _Alu(bits):
+    # Returns the ALU function for c-bits 'bits' computed the way the
+    # hardware does, for the comp fields that have no mnemonic.
+    zx = bits & 32
+    nx = bits & 16
+    zy = bits & 8
+    ny = bits & 4
+    add = bits & 2
+    no = bits & 1
+    def Alu(d, y):
+        if zx: d = 0
+        if nx: d ^= 0xFFFF
+        if zy: y = 0
+        if ny: y ^= 0xFFFF
+        out = (d + y) & 0xFFFF if add else d & y
+        return out ^ 0xFFFF if no else out
+    return Alu
+
+
+def Decode(word):
+    """
+    Returns the decoded form of instruction 'word': its value for an
+    A-command, or (alu, useM, storeA, storeD, storeM, jump) for a
+    C-command.
+    """
+    if not word & 0x8000:
+        return word
+    bits = (word >> 6) & 0x3F
+    alu = _aluDict.get(bits) or _Alu(bits)
+    return (alu, bool(word & 0x1000), bool(word & 0x20), bool(word & 0x10),
+            bool(word & 0x08), word & 0x07)
+
+
+def ReadProgram(fileName):
+    """
+    Returns the instruction codes of program 'fileName'.
+    .asm files are assembled, .bin files are binary images and
+    anything else is read as .hack text.
+    """
+    extension = os.path.splitext(fileName)[1].lower()
+    if extension == os.path.extsep + 'asm':
+        from hasm import Assembler
+        try:
+            with open(fileName) as file:
+                return list(Assembler().Words(file))
+        except OSError:
+            FatalError('Could not open source file "' + fileName + '"')
+    if extension == os.path.extsep + 'bin':
+        return LoadBinary(fileName)[0]
+    try:
+        with open(fileName) as file:
+            return [int(line, 2) for line in file if line.strip()]
+    except OSError:
+        FatalError('Could not open program file "' + fileName + '"')
+    except ValueError:
+        FatalError('"' + fileName + '" is not a Hack program file')
+
+
+class Cpu(object):
+    # The test script command that executes one instruction.
+    stepCommand = 'ticktock'
+
+    def __init__(self, compiled=False):
+        """
+        Constructor Cpu(compiled)
+        The ROM is empty (all zero) and the RAM is cleared.
+        If 'compiled' is True, the program is run as compiled basic
+        blocks instead of being interpreted.
+        """
+        self.compiled = compiled
+        self.rom = array('H', bytes(2 * ROM_SIZE))
+        self.program = [0] * ROM_SIZE
+        self.blocks = {}        # Compiled blocks by start address.
+        self.ram = array('H', bytes(2 * RAM_SIZE))
+        self.steps = 0
+        self.seconds = 0.0
+        self.Reset()
+
+
+    def Reset(self):
+        """
+        Reset the CPU: A, D and PC are set to 0.  The RAM is unchanged.
+        """
+        self.A = 0
+        self.D = 0
+        self.PC = 0
+
+
+    def Load(self, fileName):
+        """
+        Load program 'fileName' into the ROM and reset the CPU.
+        See ReadProgram().
+        """
+        self.LoadCode(ReadProgram(fileName))
+
+
+    def LoadCode(self, code):
+        """
+        Load the instruction codes 'code' into the ROM, clearing the
+        rest of it, and reset the CPU.
+        """
+        if len(code) > ROM_SIZE:
+            FatalError('Program is too large for the ROM')
+        self.rom = array('H', code)
+        self.rom.extend(array('H', bytes(2 * (ROM_SIZE - len(code)))))
+        self.program = [Decode(word) for word in code]
+        self.program.extend([0] * (ROM_SIZE - len(code)))
+        self.blocks = {}
+        self.Reset()
+
+
+    def Run(self, steps):
+        """
+        Execute 'steps' instructions.
+        The number of instructions executed and the time taken are
+        added to self.steps and self.seconds.
+        """
+        start = time.perf_counter()
+        if self.compiled:
+            steps -= self._RunBlocks(steps)
+        self._Interpret(steps)
+        self.seconds += time.perf_counter() - start
+
+
+    def _RunBlocks(self, steps):
+        # Run compiled blocks while there are enough steps left for the
+        # next one.  Returns the number of steps run.
+        blocks = self.blocks
+        ram = self.ram
+        A = self.A
+        D = self.D
+        pc = self.PC
+        left = steps
+        try:
+            while True:
+                block = blocks.get(pc)
+                if block == None:
+                    # The PC is 15 bits wide.
+                    pc &= ROM_SIZE - 1
+                    block = blocks.get(pc)
+                    if block == None:
+                        block = CompileBlock(self.rom, self.program, pc)
+                        blocks[pc] = block
+                (function, length) = block
+                if length > left:
+                    break
+                (A, D, pc) = function(A, D, ram)
+                left -= length
+        except IndexError:
+            # The block has run part way.  As the access is an error,
+            # its state is only reported.
+            self.steps += steps - left
+            FatalError('Access to RAM address out of range in block at '
+                       'PC=%d' % pc)
+        self.A = A
+        self.D = D
+        self.PC = pc
+        self.steps += steps - left
+        return steps - left
+
+
+    def _Interpret(self, steps):
+        # Execute 'steps' instructions one at a time.
+        program = self.program
+        ram = self.ram
+        A = self.A
+        D = self.D
+        pc = self.PC
+        left = steps
+        while left > 0:
+            step = 0
+            try:
+                for step in range(left):
+                    op = program[pc]
+                    if op.__class__ is int:
+                        A = op
+                        pc += 1
+                        continue
+                    (alu, useM, storeA, storeD, storeM, jump) = op
+                    out = alu(D, ram[A] if useM else A)
+                    if storeM:
+                        ram[A] = out
+                    if storeD:
+                        D = out
+                    if jump and jump & (_JEQ if out == 0 else
+                                        _JLT if out & 0x8000 else _JGT):
+                        pc = A
+                    else:
+                        pc += 1
+                    if storeA:
+                        A = out
+                left = 0
+            except IndexError:
+                left -= step
+                if pc < ROM_SIZE:
+                    self.A = A
+                    self.D = D
+                    self.PC = pc
+                    self.steps += steps - left
+                    FatalError('Access to RAM address %d out of range '
+                               '(PC=%d)' % (A, pc))
+                # The PC is 15 bits wide.
+                pc &= ROM_SIZE - 1
+        self.A = A
+        self.D = D
+        self.PC = pc
+        self.steps += steps
+
+
+    def _Invalidate(self, address):
+        # Drop the compiled blocks that contain ROM 'address'.
+        for (start, (_, length)) in list(self.blocks.items()):
+            if start <= address < start + length:
+                del self.blocks[start]
+
+
+    def Get(self, name):
+        """
+        Returns the value of script variable 'name': A, D, PC or
+        RAM[address].
+        """
+        return self._Variable(name, None)
+
+
+    def Set(self, name, value):
+        """
+        Set script variable 'name' to 'value'.
+        """
+        self._Variable(name, value & 0xFFFF)
+
+
+    def _Variable(self, name, value):
+        match = re.match(r'(RAM|ROM)\[(\d+)\]\Z', name)
+        if match:
+            address = int(match.group(2))
+            memory = self.ram if match.group(1) == 'RAM' else self.rom
+            if address >= len(memory):
+                FatalError('Address out of range: ' + name)
+            if value == None:
+                return memory[address]
+            memory[address] = value
+            if memory is self.rom:
+                self.program[address] = Decode(value)
+                self._Invalidate(address)
+        elif name in ('A', 'D', 'PC'):
+            if value == None:
+                return getattr(self, name)
+            setattr(self, name, value & 0x7FFF if name == 'PC' else value)
+        else:
+            FatalError('Unknown variable ' + name)
+
+
+# Tokens of the test script language.
+_tokenRe = re.compile(r'//[^\n]*|/\*.*?\*/|([{}]|[,;]|[^\s,;{}]+)', re.S)
+
+# output-list entry: variable, format, left pad, width, right pad.
+_outputRe = re.compile(r'([^%]+)(?:%([BDXS])(\d+)\.(\d+)\.(\d+))?\Z')
+
+
+def _Commands(tokens):
+    # Parse a list of tokens into a list of commands, each a list of
+    # words.  A repeat command is ['repeat', count, body commands].
+    commands = []
+    command = []
+    while tokens:
+        token = tokens.pop(0)
+        if token in (',', ';'):
+            if command:
+                commands.append(command)
+            command = []
+        elif token == '{':
+            command.append(_Commands(tokens))
+            commands.append(command)
+            command = []
+        elif token == '}':
+            break
+        else:
+            command.append(token)
+    if command:
+        commands.append(command)
+    return commands
+
+
+def _Format(value, format, width):
+    # Returns 'value' formatted as 'format' in 'width' characters.
+    if format == 'B':
+        return ('0' * width + '{:b}'.format(value))[-width:]
+    if format == 'X':
+        return ('0' * width + '{:X}'.format(value))[-width:]
+    if value & 0x8000:
+        value -= 0x10000
+    return str(value).rjust(width)
+
+
+class Script(object):
+
+    def __init__(self, scriptName, cpu=None):
+        """
+        Constructor Script(scriptName, cpu)
+        Read test script 'scriptName' to be run on 'cpu', or on a new
+        Cpu if it is None.  'cpu' may be any machine with the Load(),
+        Run(), Get() and Set() methods and stepCommand of Cpu.
+        """
+        try:
+            with open(scriptName) as file:
+                text = file.read()
+        except OSError:
+            FatalError('Could not open script file "' + scriptName + '"')
+        self.dirName = os.path.dirname(scriptName)
+        self.cpu = cpu if cpu != None else Cpu()
+        self.commands = _Commands([token for token in
+                                   _tokenRe.findall(text) if token])
+        self.outputList = []
+        self.outFile = None
+        self.compareLines = None
+        self.lineNumber = 0
+        self.ok = True
+
+
+    def Run(self):
+        """
+        Run the script.
+        Returns True if all output matched the compare-to file.
+        """
+        try:
+            self._Execute(self.commands)
+        finally:
+            if self.outFile != None:
+                self.outFile.close()
+        return self.ok
+
+
+    def _Path(self, name):
+        return os.path.join(self.dirName, name)
+
+
+    def _Execute(self, commands):
+        for command in commands:
+            if not self.ok:
+                return
+            name = command[0]
+            if name == self.cpu.stepCommand:
+                self.cpu.Run(1)
+            elif name == 'repeat':
+                count = int(command[1])
+                body = command[2]
+                if body == [[self.cpu.stepCommand]]:
+                    self.cpu.Run(count)
+                else:
+                    for _ in range(count):
+                        self._Execute(body)
+            elif name == 'set':
+                self.cpu.Set(command[1], _Value(command[2]))
+            elif name == 'output':
+                self._Output([_Format(self.cpu.Get(variable), format, width)
+                              .ljust(width + right).rjust(left + width
+                                                          + right)
+                              for (variable, format, left, width, right)
+                              in self.outputList])
+            elif name == 'output-list':
+                self.outputList = [_OutputItem(item) for item in command[1:]]
+                self._Output([variable[:left + width + right]
+                              .center(left + width + right)
+                              for (variable, format, left, width, right)
+                              in self.outputList])
+            elif name == 'load':
+                # With no file name, load the script's directory.
+                self.cpu.Load(self._Path(command[1]) if len(command) > 1
+                              else self.dirName or os.curdir)
+            elif name == 'output-file':
+                try:
+                    self.outFile = open(self._Path(command[1]), 'w')
+                except OSError:
+                    FatalError('Could not open output file "' + command[1]
+                               + '"')
+            elif name == 'compare-to':
+                try:
+                    with open(self._Path(command[1])) as file:
+                        self.compareLines = file.read().splitlines()
+                except OSError:
+                    FatalError('Could not open compare file "' + command[1]
+                               + '"')
+            elif name == 'echo':
+                print(' '.join(command[1:]).strip('"'))
+            elif name == 'clear-echo':
+                pass
+            else:
+                FatalError('Unsupported script command: ' + ' '.join(
+                    word for word in command if isinstance(word, str)))
+
+
+    def _Output(self, fields):
+        line = '|' + '|'.join(fields) + '|'
+        if self.outFile != None:
+            self.outFile.write(line + '\n')
+        if self.compareLines != None:
+            self.lineNumber += 1
+            if (self.lineNumber > len(self.compareLines)
+                    or self.compareLines[self.lineNumber - 1] != line):
+                Error('Comparison failure at line %d' % self.lineNumber)
+                self.ok = False
+
+
+def _OutputItem(item):
+    # Returns (variable, format, left, width, right) for an output-list
+    # entry such as RAM[0]%D2.6.2.
+    match = _outputRe.match(item)
+    if not match:
+        FatalError('Bad output-list entry ' + item)
+    if match.group(2) == None:
+        return (match.group(1), 'D', 1, 6, 1)
+    return (match.group(1), match.group(2), int(match.group(3)),
+            int(match.group(4)), int(match.group(5)))
+
+
+def _Value(text):
+    # Returns the value of a script constant: decimal, or %B, %X or %D
+    # followed by digits.
+    try:
+        if text.startswith('%B'):
+            return int(text[2:], 2)
+        if text.startswith('%X'):
+            return int(text[2:], 16)
+        if text.startswith('%D'):
+            return int(text[2:])
+        return int(text)
+    except ValueError:
+        FatalError('Bad value ' + text)
+
+
+def Usage():
+    print('usage: hcpu [-n steps] [-compile] file')
+    print('    file is a .tst test script, or a .hack, .bin or .asm program')
+    print('    which is run for steps instructions (default 1000000).')
+    print('    -compile option runs the program as compiled basic blocks.')
+    sys.exit(-1)
+
+
+def Main():
+    try:
+        steps = 1000000
+        compiled = False
+        while True:
+            if len(sys.argv) >= 2 and sys.argv[1] == '-compile':
+                compiled = True
+                del (sys.argv[1])
+                continue
+            if len(sys.argv) >= 3 and sys.argv[1] == '-n':
+                try:
+                    steps = int(sys.argv[2])
+                except ValueError:
+                    Usage()
+                del (sys.argv[1:3])
+                continue
+            break
+
+        if len(sys.argv) != 2:
+            Usage()
+
+        fileName = sys.argv[1]
+        cpu = Cpu(compiled)
+        if os.path.splitext(fileName)[1].lower() == os.path.extsep + 'tst':
+            ok = Script(fileName, cpu).Run()
+            if ok:
+                print('Comparison ended successfully')
+        else:
+            cpu.Load(fileName)
+            cpu.Run(steps)
+            ok = True
+            print('A = %d, D = %d, PC = %d' % (cpu.A, cpu.D, cpu.PC))
+        print('%d steps in %.3fs (%d steps/s)' %
+              (cpu.steps, cpu.seconds,
+               cpu.steps / cpu.seconds if cpu.seconds else 0))
+        if not ok:
+            sys.exit(-1)
+
+    except SystemExit as e:
+        sys.exit(e)
+
+
+if __name__ == '__main__':
+    Main()
@@ -0,0 +1,138 @@
+"""
+hcpuBatch.py -- Batch emulation of many Hack computers with NumPy
+
+Batch runs one program on many machines at once, each with its own
+RAM, A, D and PC.  The RAM of all machines is one 2-D array, a row
+per machine, and each step applies an instruction to all the
+machines at that instruction's address as vectorized operations.
+
+Machines start in lockstep and stay there until a conditional jump
+goes different ways.  From then on each step groups the machines by
+PC and runs each group's instruction, so every machine still
+executes exactly one instruction per step and ends in the same state
+as a Cpu run for the same number of steps.
+
+NumPy is needed only by this module.
+"""
+
+import time
+from hasmError import *
+from hcpu import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class Batch(object):
+
+    def __init__(self, count):
+        """
+        Constructor Batch(count)
+        'count' machines with an empty ROM and cleared RAM.
+        """
+        if numpy == None:
+            FatalError('The batch emulator needs NumPy')
+        self.count = count
+        self.lanes = numpy.arange(count)
+        self.ram = numpy.zeros((count, RAM_SIZE), numpy.uint16)
+        self.program = [0] * ROM_SIZE
+        self.steps = 0
+        self.seconds = 0.0
+        self.Reset()
+
+
+    def Reset(self):
+        """
+        Reset all machines: A, D and PC are set to 0.  The RAM is
+        unchanged.
+        """
+        self.A = numpy.zeros(self.count, numpy.int64)
+        self.D = numpy.zeros(self.count, numpy.int64)
+        self.PC = numpy.zeros(self.count, numpy.int64)
+
+
+    def Load(self, fileName):
+        """
+        Load program 'fileName' into the ROM of all machines and reset
+        them.  See hcpu.ReadProgram().
+        """
+        self.LoadCode(ReadProgram(fileName))
+
+
+    def LoadCode(self, code):
+        """
+        Load the instruction codes 'code' into the ROM of all machines,
+        clearing the rest of it, and reset them.
+        """
+        if len(code) > ROM_SIZE:
+            FatalError('Program is too large for the ROM')
+        self.program = [Decode(word) for word in code]
+        self.program.extend([0] * (ROM_SIZE - len(code)))
+        self.Reset()
+
+
+    def Run(self, steps):
+        """
+        Execute 'steps' instructions on every machine.
+        """
+        start = time.perf_counter()
+        PC = self.PC
+        for _ in range(steps):
+            pc = int(PC[0])
+            if (PC == pc).all():
+                self._Execute(pc, slice(None), self.lanes)
+                continue
+            # The machines have diverged.  Group them before running
+            # any group, so that a machine whose PC moves to another
+            # group's PC does not run twice in this step.
+            groups = [(int(pc), numpy.flatnonzero(PC == pc))
+                      for pc in numpy.unique(PC)]
+            for (pc, lanes) in groups:
+                self._Execute(pc, lanes, lanes)
+        self.steps += steps
+        self.seconds += time.perf_counter() - start
+
+
+    def _Execute(self, pc, lanes, rows):
+        # Execute the instruction at 'pc' on the machines 'lanes', an
+        # index or a slice.  'rows' is the same machines as an index.
+        # A, D and the ALU output are int64; the RAM is uint16.
+        op = self.program[pc]
+        if op.__class__ is int:
+            self.A[lanes] = op
+            self.PC[lanes] = (pc + 1) & (ROM_SIZE - 1)
+            return
+        (alu, useM, storeA, storeD, storeM, jump) = op
+        A = self.A[lanes]
+        if (useM or storeM) and (A >= RAM_SIZE).any():
+            FatalError('Access to RAM address %d out of range (PC=%d)' %
+                       (A.max(), pc))
+        # The ALU functions for comps with no mnemonic negate their
+        # arguments in place, so they are given copies, not views of
+        # the registers.
+        out = alu(self.D[lanes].copy(), self.ram[rows, A].astype(numpy.int64)
+                  if useM else A.copy())
+        if numpy.ndim(out) == 0:
+            out = numpy.full(len(A), out, numpy.int64)
+        if storeM:
+            self.ram[rows, A] = out
+        if storeD:
+            self.D[lanes] = out
+        if jump == 7:
+            self.PC[lanes] = A & (ROM_SIZE - 1)
+        elif jump:
+            taken = numpy.zeros(len(A), bool)
+            if jump & 4:       # JLT
+                taken |= out >= 0x8000
+            if jump & 2:       # JEQ
+                taken |= out == 0
+            if jump & 1:       # JGT
+                taken |= (out != 0) & (out < 0x8000)
+            self.PC[lanes] = numpy.where(taken, A & (ROM_SIZE - 1),
+                                         (pc + 1) & (ROM_SIZE - 1))
+        else:
+            self.PC[lanes] = (pc + 1) & (ROM_SIZE - 1)
+        if storeA:
+            self.A[lanes] = out
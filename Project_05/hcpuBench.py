@@ -0,0 +1,213 @@
+#!/usr/bin/python3
+"""
+hcpuBench.py -- Benchmarks for the Hack computer CPU emulator
+
+usage: hcpuBench [-n steps] [benchmark ...]
+
+Runs Hack programs for a number of steps and reports instructions per
+second.  With no benchmark names all benchmarks are run.
+"""
+
+import sys
+import os
+import time
+import random
+import tempfile
+import hcpu
+import hcpuBatch
+
+
+_projects = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         os.pardir, 'nand2tetris', 'projects')
+
+
+# Steps at which BenchBatch() compares machines with Cpu runs.  The
+# machines multiplying by up to 19 are still in their loops up to about
+# 160 steps.
+_checkpoints = (1, 5, 8, 13, 37, 64, 101, 150)
+
+
+def GenerateLoop(fileName):
+    """
+    Write a program to 'fileName' that keeps a stack machine style
+    running sum: a loop that pushes a counter, adds it to a static
+    and compares it against a limit, like VM translator output.
+    """
+    lines = ['@256', 'D=A', '@SP', 'M=D',
+             '(RESTART)', '@1000', 'D=A', '@counter', 'M=D',
+             '(LOOP)',
+             '@counter', 'D=M', '@SP', 'A=M', 'M=D', '@SP', 'M=M+1',
+             '@SP', 'AM=M-1', 'D=M', '@sum', 'M=D+M',
+             '@counter', 'MD=M-1', '@LOOP', 'D;JGT',
+             '@RESTART', '0;JMP']
+    with open(fileName, 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+
+
+def GenerateMult(fileName):
+    """
+    Write a program to 'fileName' that sets R2 = R0 * R1 by repeated
+    addition and then loops forever.  The number of iterations depends
+    on R1, and an odd R1 skips an instruction, so machines running it
+    with different inputs diverge and run an instruction apart.
+    The two D&A commands, which do nothing, are for MultCode().
+    """
+    lines = ['@R2', 'M=0', '@R1', 'D=M', 'D&A', '@R3', 'M=D',
+             '@1', 'D=D&A', '@LOOP', 'D&A', 'D;JNE', 'D=0',
+             '(LOOP)',
+             '@R3', 'D=M', '@END', 'D;JEQ',
+             '@R0', 'D=M', '@R2', 'M=D+M', '@R3', 'M=M-1',
+             '@LOOP', '0;JMP',
+             '(END)', '@END', '0;JMP']
+    with open(fileName, 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+
+
+def MultCode(fileName):
+    """
+    Returns the instruction codes of the GenerateMult() program in
+    'fileName' with its two D&A commands made into the comps with nx
+    and with ny set, which have no mnemonic.  They still do nothing,
+    but an emulator that negates D or A in place gets them wrong.
+    """
+    code = hcpu.ReadProgram(fileName)
+    first = code.index(0xE000)
+    code[first] = 0xE000 | (0b010000 << 6)
+    code[code.index(0xE000, first + 1)] = 0xE000 | (0b000100 << 6)
+    return code
+
+
+def State(cpu):
+    return (cpu.A, cpu.D, cpu.PC, bytes(cpu.ram))
+
+
+def Compare(name, fileName, steps):
+    """
+    Run 'fileName' for 'steps' instructions interpreted and as
+    compiled blocks, and report instructions/s for each.
+    """
+    results = []
+    for compiled in (False, True):
+        cpu = hcpu.Cpu(compiled)
+        cpu.Load(fileName)
+        start = time.perf_counter()
+        cpu.Run(steps)
+        elapsed = time.perf_counter() - start
+        results.append((elapsed, State(cpu), len(cpu.blocks)))
+    ((interpreted, state, _), (compiled, compiledState, blocks)) = results
+    print('%s: interpreter %.3fs (%d instructions/s)' %
+          (name, interpreted, steps / interpreted))
+    print('%s  compiled    %.3fs (%d instructions/s), %d blocks' %
+          (' ' * len(name), compiled, steps / compiled, blocks))
+    print('%s  speedup %.2fx, state %s' %
+          (' ' * len(name), interpreted / compiled,
+           'identical' if state == compiledState else 'DIFFERENT'))
+
+
+def BenchPong(dirName, steps):
+    """
+    The project 6 Pong program, compiled from Jack by the VM
+    translator.
+    """
+    Compare('pong', os.path.join(_projects, '6', 'pong', 'Pong.asm'), steps)
+
+
+def BenchLoop(dirName, steps):
+    """
+    A tight loop of stack code.
+    """
+    fileName = os.path.join(dirName, 'Loop.asm')
+    GenerateLoop(fileName)
+    Compare('loop', fileName, steps)
+
+
+def BenchBatch(dirName, steps):
+    """
+    Machine-steps/s of a Batch of machines multiplying different
+    inputs, versus one interpreted Cpu.  Scaled down from 'steps' as
+    each batch step runs every machine.  The state of some of the
+    machines is checked against Cpu runs at '_checkpoints' while they
+    are still on different paths through the loop, and at the end.
+    """
+    if hcpuBatch.numpy is None:
+        print('batch: NumPy is not installed')
+        return
+    fileName = os.path.join(dirName, 'Mult.asm')
+    GenerateMult(fileName)
+    code = MultCode(fileName)
+    batchSteps = max(steps // 1000, 1000)
+    random.seed(1)
+    inputs = [(random.randrange(100), random.randrange(20))
+              for _ in range(10000)]
+
+    cpu = hcpu.Cpu()
+    cpu.LoadCode(code)
+    cpu.Run(steps)
+    single = cpu.steps / cpu.seconds
+    print('batch: one Cpu        %d machine-steps/s' % single)
+
+    for count in (100, 1000, 10000):
+        batch = hcpuBatch.Batch(count)
+        batch.LoadCode(code)
+        batch.ram[:, 0] = [x for (x, _) in inputs[:count]]
+        batch.ram[:, 1] = [y for (_, y) in inputs[:count]]
+        cpus = {}
+        for lane in random.sample(range(count), 10):
+            cpus[lane] = hcpu.Cpu()
+            cpus[lane].LoadCode(code)
+            (cpus[lane].ram[0], cpus[lane].ram[1]) = inputs[lane]
+        ok = True
+        for checkpoint in [step for step in _checkpoints
+                           if step < batchSteps] + [batchSteps]:
+            batch.Run(checkpoint - batch.steps)
+            for (lane, cpu) in cpus.items():
+                cpu.Run(checkpoint - cpu.steps)
+                if State(cpu) != (batch.A[lane], batch.D[lane],
+                                  batch.PC[lane], batch.ram[lane].tobytes()):
+                    ok = False
+        for (lane, cpu) in cpus.items():
+            if cpu.ram[2] != inputs[lane][0] * inputs[lane][1]:
+                ok = False
+        rate = count * batch.steps / batch.seconds
+        print('       %5d machines %d machine-steps/s (%.1fx), state %s' %
+              (count, rate, rate / single,
+               'identical' if ok else 'DIFFERENT'))
+
+
+benchmarks = {
+    'pong': BenchPong,
+    'loop': BenchLoop,
+    'batch': BenchBatch,
+    }
+
+
+def Usage():
+    print('usage: hcpuBench [-n steps] [benchmark ...]')
+    print('    benchmarks: ' + ' '.join(benchmarks))
+    sys.exit(-1)
+
+
+def Main():
+    steps = 5000000
+    while True:
+        if len(sys.argv) >= 3 and sys.argv[1] == '-n':
+            try:
+                steps = int(sys.argv[2])
+            except ValueError:
+                Usage()
+            del (sys.argv[1:3])
+            continue
+        break
+
+    names = sys.argv[1:] or list(benchmarks)
+    for name in names:
+        if name not in benchmarks:
+            Usage()
+
+    with tempfile.TemporaryDirectory() as dirName:
+        for name in names:
+            benchmarks[name](dirName, steps)
+
+
+if __name__ == '__main__':
+    Main()
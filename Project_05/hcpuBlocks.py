@@ -0,0 +1,127 @@
+"""
+hcpuBlocks.py -- Basic block compiler for Hack computer CPU emulator
+
+CompileBlock() translates the instructions from a ROM address up to
+and including the next jump into the source of one Python function,
+and compiles it.  The function takes (A, D, ram) and returns the new
+(A, D, PC), so a whole block runs as one call with A, D and the stored
+values in local variables.
+
+A-command values are folded into the code that uses them:  @SP, M=M+1
+becomes ram[0] = (ram[0] + 1) & 65535, and A is only assigned when the
+block exits.
+
+Blocks are entered at whatever address control reaches, so a label in
+the middle of a block starts a new, overlapping block the first time
+it is jumped to.
+"""
+
+# Longest block.  A block only runs if the CPU has that many steps
+# left to run; the last few steps are interpreted.
+MAX_BLOCK = 64
+
+# Expressions of the documented comp fields, by the 6 c-bits.
+# {y} is A or M.
+_compDict = {
+    0b101010: '0',
+    0b111111: '1',
+    0b111010: '65535',
+    0b001100: 'D',
+    0b110000: '{y}',
+    0b001101: 'D ^ 65535',
+    0b110001: '{y} ^ 65535',
+    0b001111: '-D & 65535',
+    0b110011: '-{y} & 65535',
+    0b011111: '(D + 1) & 65535',
+    0b110111: '({y} + 1) & 65535',
+    0b001110: '(D - 1) & 65535',
+    0b110010: '({y} - 1) & 65535',
+    0b000010: '(D + {y}) & 65535',
+    0b010011: '(D - {y}) & 65535',
+    0b000111: '({y} - D) & 65535',
+    0b000000: 'D & {y}',
+    0b010101: 'D | {y}',
+    }
+
+# Jump conditions on the ALU output t, by the jump field.
+_jumpDict = {
+    1: '0 < t < 32768',
+    2: 't == 0',
+    3: 't < 32768',
+    4: 't >= 32768',
+    5: 't != 0',
+    6: 't == 0 or t >= 32768',
+    }
+
+
+def CompileBlock(rom, program, start):
+    """
+    Compile the block of instruction codes 'rom' starting at 'start'.
+    'program' is the ROM decoded by hcpu.Decode(), for the ALU
+    functions of comp fields that have no mnemonic.
+    Returns (function, length): the block's function and the number of
+    instructions it executes.
+    """
+    lines = []
+    names = {}
+    knownA = None       # A's value if it is a constant, else None.
+    pc = start
+    end = min(len(rom), start + MAX_BLOCK)
+    exit = None
+    while pc < end:
+        word = rom[pc]
+        pc += 1
+        if not word & 0x8000:
+            knownA = word
+            continue
+
+        a = 'A' if knownA == None else str(knownA)
+        bits = (word >> 6) & 0x3F
+        y = ('ram[%s]' % a) if word & 0x1000 else a
+        if bits in _compDict:
+            expression = _compDict[bits].format(y=y)
+        else:
+            name = '_alu%d' % bits
+            names[name] = program[pc - 1][0]
+            expression = '%s(D, %s)' % (name, y)
+
+        dest = []
+        if word & 0x08:
+            dest.append('ram[%s]' % a)
+        if word & 0x10:
+            dest.append('D')
+        jump = word & 0x07
+        if jump:
+            # The jump target is A before this command stores to it.
+            target = a
+            if word & 0x20 and knownA == None:
+                lines.append('j = A')
+                target = 'j'
+        if word & 0x20:
+            dest.append('A')
+            knownA = None
+
+        if not jump and len(dest) == 1:
+            lines.append('%s = %s' % (dest[0], expression))
+            continue
+        lines.append('t = ' + expression)
+        for name in dest:
+            lines.append('%s = t' % name)
+        if jump:
+            a = 'A' if knownA == None else str(knownA)
+            if jump == 7:
+                exit = 'return (%s, D, %s)' % (a, target)
+            else:
+                exit = 'return (%s, D, %s if %s else %d)' % (
+                    a, target, _jumpDict[jump], pc)
+            break
+
+    if exit == None:
+        a = 'A' if knownA == None else str(knownA)
+        exit = 'return (%s, D, %d)' % (a, pc)
+    source = ('def _Block(A, D, ram):\n'
+              + ''.join('    %s\n' % line for line in lines)
+              + '    ' + exit + '\n')
+    code = compile(source, '<block %d>' % start, 'exec')
+    exec(code, names)
+    return (names['_Block'], pc - start)